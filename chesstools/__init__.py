@@ -17,7 +17,7 @@ except:
 
 COLORS = {'white':'black','black':'white'}
 
-from . import board, move, list, timer, piece, ai, book
+from . import board, move, list, timer, piece, ai, book, pgn
 from .board import Board
 from .move import Move
 from .list import List
@@ -1 +1,3 @@
-from .brain import AI
\ No newline at end of file
+from .brain import AI
+from .evaluator import Evaluator, Tally
+from .stats import SearchStats
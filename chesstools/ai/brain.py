@@ -1,38 +1,208 @@
+import asyncio
 from fyg.util import Loggy
-from _thread import start_new_thread
+from threading import Thread, current_thread
 from random import choice as ranchoice
-from .transposition import Table
+from multiprocessing import RawValue
+from concurrent.futures import ProcessPoolExecutor
+from chesstools import COLORS
+from chesstools.board import Board
+from chesstools.move import Move
+from .transposition import Table, EXACT, LOWER, UPPER
 from .variation import Variation
-from .thinker import Thinker
+from .thinker import Thinker, SearchTimeout
+from .stats import SearchStats
+from . import features
 
 INFINITY = float('inf')
+VALUES = {'Pawn': 1, 'Knight': 3, 'Bishop': 3, 'Rook': 5, 'Queen': 9, 'King': 20}
+PROMOTIONS = {'q': 9, 'r': 5, 'b': 3, 'n': 3}
+_worker = None
+
+def _init_worker(ai, halt):
+    global _worker
+    _worker = ai
+    ai._table = Table(False, ai._tablesize, hashed=ai._hashdb, offline=True)
+    ai._thinker.halt = halt
+
+def _remote_step(snapshot, depth, alpha, beta, deadline, withdb, age):
+    return _worker._remote_step(snapshot, depth, alpha, beta, deadline, withdb, age)
 
 class AI(Loggy):
-    def __init__(self, timer, move, output=None, book=None, depth=1, random=1, rofflim=3, dbuntil=20, rushbelow=240, preppy=True):
+    evaluate_batch = None # optional: (planes, color) -> scores for color, see features.planes()
+
+    def __init__(self, timer, move, output=None, book=None, depth=1, random=1, rofflim=3, dbuntil=20, rushbelow=240, preppy=True, movestogo=30, workers=0, quiesce=True, qdepth=None, tablesize=64, hashdb=True, stats=None, profiler=None, ponder=False):
         self._depth = depth
+        self._quiesce = quiesce
+        self._qdepth = qdepth
+        self._workers = workers
+        self._ponder = ponder
+        self._ponderkey = None
+        self._thread = None
+        self._pool = None
         self._move_cb = move
         self._output_cb = output
+        self._stats_cb = stats
         self._book = book
         self._random = random
-        self._table = Table(preppy)
+        self._table = Table(preppy, tablesize, hashed=hashdb)
+        self._tablesize = tablesize
+        self._hashdb = hashdb
+        self._table.unmigrated()
+        self._killers = {}
+        self._history = {}
+        self._stats = SearchStats()
+        self.stats = None
         self._thinker = Thinker(self._table, timer, self._depth, self._step,
-            self._move, self._branches, self._report, rofflim, dbuntil, rushbelow)
+            self._move, self._branches, self._report, rofflim, dbuntil, rushbelow, movestogo,
+            self._remote, workers, random == 1, profiler)
+        if workers > 1:
+            self._thinker.halt = RawValue('b', 0)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_move_cb', '_output_cb', '_stats_cb', '_book', '_table', '_thinker', '_pool', '_thread']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._move_cb = self._output_cb = self._stats_cb = self._book = self._pool = self._thread = None
+        self._table = Table(False, 1)
+        self._thinker = Thinker(self._table, None, self._depth, self._step,
+            None, self._branches, self._report)
 
     def __call__(self, board, color):
+        self._play(board, color)
+
+    async def think(self, board, color, *, deadline=None):
+        # deadline is an absolute time() - returns (move, stats), or None if there is no move
+        search = asyncio.get_running_loop().run_in_executor(None, self._think, board.copy(), color, deadline)
+        try:
+            return await asyncio.shield(search)
+        except asyncio.CancelledError:
+            while not search.done(): # the search may not have started yet
+                self._thinker.stop()
+                await asyncio.wait([search], timeout=0.01)
+            raise
+
+    def _think(self, board, color, deadline=None):
+        self.stats = None
+        thread = self._play(board, color, deadline)
+        if thread:
+            thread.join()
+        if self.stats:
+            return self.stats.move, self.stats
+
+    def _play(self, board, color, deadline=None):
+        if self._ponderkey is not None:
+            if self._ponderkey == board.hash() and not self._thinker.stopped:
+                self._ponderkey = None
+                self.log("ponder hit")
+                thread = self._thread
+                self._thinker.ponderhit(deadline)
+                return thread
+            self.log("ponder miss")
+            self.stop()
         if self._book:
-            moves = self._book.check(board.fen_signature())
+            moves = self._book.probe(board)
             if moves:
-                return self._move(moves)
-        self._thinker.setBoard(board, color)
-        start_new_thread(self._thinker, ())
+                self._move(moves, SearchStats(True))
+                return
+        return self._search(board, color, deadline=deadline)
+
+    def _search(self, board, color, ponder=False, deadline=None):
+        self._killers = {}
+        for key in list(self._history.keys()):
+            self._history[key] //= 2
+        self._stats = SearchStats()
+        self._thinker.setBoard(board.copy(), color, self._stats, ponder, deadline)
+        self._thread = Thread(target=self._thinker)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._ponderkey = None
+        self._thinker.stop()
+        if self._thread and self._thread is not current_thread():
+            self._thread.join()
 
-    def _branches(self, board, withdb=False, timed=False):
-        branches = [Variation(board, move) for move in board.all_legal_moves()]
-        withdb and self._table.prep([b.signature() for b in branches], timed)
+    def _expect(self, board, move):
+        board = board.copy()
+        board.push(Move(*move))
+        reply = self._table.move(board.hash())
+        if reply in [m.from_to_promotion() for m in board.all_legal_moves()]:
+            board.push(Move(*reply))
+            if board.all_legal_moves():
+                self.log("pondering on", Move(*reply))
+                return board
+
+    def _remote(self, branch, depth, alpha, beta, deadline, withdb=False):
+        if not self._pool:
+            self._pool = ProcessPoolExecutor(self._workers,
+                initializer=_init_worker, initargs=(self, self._thinker.halt))
+        return self._pool.submit(_remote_step, branch.snapshot(), depth, alpha, beta, deadline, withdb, self._table.age)
+
+    def _remote_step(self, snapshot, depth, alpha, beta, deadline, withdb, age):
+        self._table.age = age # one table per worker, aged along with the parent's
+        self._stats = SearchStats()
+        self._thinker.deadline = deadline
+        variation = Variation(Board(fen=snapshot), None, current=True)
+        self._step(variation, depth, alpha, beta, withdb)
+        self._stats.collect(self._table)
+        return variation.score, self._table.entries([variation.key()]), self._table.rows(), self._stats
+
+    def _order(self, board, moves, ply):
+        best = self._table.move(board.hash())
+        killers = self._killers.get(ply, [])
+        def rank(move):
+            ftp = move.from_to_promotion()
+            if ftp == best:
+                return (3, 0)
+            victim = board.get_square(move.destination)
+            if victim or move.promotion:
+                return (2, 10 * (victim and VALUES[victim.name] or 0)
+                    + (move.promotion and PROMOTIONS[move.promotion.lower()] or 0)
+                    - VALUES[board.get_square(move.source).name])
+            if ftp in killers:
+                return (1, -killers.index(ftp))
+            return (0, self._history.get(ftp, 0))
+        moves.sort(key=rank, reverse=True)
+        return moves
+
+    def _cutoff(self, board, move, depth, ply, first):
+        self._stats.cutoffs += 1
+        if first:
+            self._stats.firsts += 1
+        if board.get_square(move.destination) or move.promotion:
+            return
+        ftp = move.from_to_promotion()
+        killers = self._killers.setdefault(ply, [])
+        if ftp not in killers:
+            killers.insert(0, ftp)
+            del killers[2:]
+        self._history[ftp] = self._history.get(ftp, 0) + depth * depth
+
+    def _branches(self, board, withdb=False, timed=False, ply=0):
+        moves = self._order(board, board.all_legal_moves(), ply)
+        branches = [Variation(board, move) for move in moves]
+        withdb and self._table.prep(branches, timed)
         return branches
 
-    def _move(self, moves):
-        self._move_cb(*ranchoice(moves[:self._random]))
+    def _move(self, moves, stats):
+        move = ranchoice(moves[:self._random])
+        self.stats = stats.finish(move)
+        if stats.nodes:
+            self.log(stats, "cutoffs:", stats.cutoffs, "first-move cutoff rate:",
+                round(stats.firsts / max(stats.cutoffs, 1), 3))
+        self._stats_cb and self._stats_cb(stats)
+        if self._ponder and not stats.book:
+            board = self._expect(self._thinker.board, move)
+            if board:
+                self._ponderkey = board.hash()
+                self._search(board, self._thinker.color, True)
+        self._move_cb and self._move_cb(*move)
+        return move, stats
 
     def _report(self, data, loud=False):
         if self._output_cb:
@@ -40,26 +210,77 @@ class AI(Loggy):
         if loud:
             self.log(data)
 
-    def _score(self, variation, score, depth=INFINITY, withdb=False):
+    def _score(self, variation, score, depth=INFINITY, withdb=False, move=None, bound=EXACT):
         variation.score = score
-        self._table.score(variation, score, depth, withdb)
-
-    def _step(self, variation, depth, alpha, beta, withdb=False):
-        sig = variation.signature()
-        dtup = self._table.get(sig, depth, depth and withdb)
-        if dtup:
-            variation.score = dtup[1]
-            return True
-        if not depth:
-            return self._score(variation, self.evaluate(variation.board), 0)
-        branches = self._branches(variation.board, withdb)
-        if not branches:
-            return self._score(variation, -INFINITY, withdb=withdb)
+        self._table.score(variation, score, depth, withdb, move, bound)
+
+    def _bound(self, score, alpha, beta):
+        if score <= alpha:
+            return UPPER
+        if score >= beta:
+            return LOWER
+        return EXACT
+
+    def _statics(self, board, branches):
+        rows = []
         for branch in branches:
-            self._step(branch, depth-1, -beta, -alpha, withdb)
-            alpha = max(alpha, -branch.score)
-            if alpha >= beta: break
-        self._score(variation, alpha, depth, withdb)
+            with branch as child:
+                rows.append(features.bitboards(child))
+        return list(self.evaluate_batch(features.planes(rows), COLORS[board.turn]))
+
+    def _step(self, variation, depth, alpha, beta, withdb=False, ply=1, static=None):
+        if self._thinker.expired():
+            raise SearchTimeout()
+        self._stats.nodes += 1
+        with variation as board:
+            dtup = self._table.get(variation, depth, depth and withdb, alpha, beta)
+            if dtup:
+                variation.score = dtup[1]
+                return True
+            if not depth:
+                if self._quiesce:
+                    score = self._qstep(board, alpha, beta, stand=static)
+                    return self._score(variation, score, 0, bound=self._bound(score, alpha, beta))
+                if static is None:
+                    static = self.evaluate(board)
+                return self._score(variation, static, 0)
+            branches = self._branches(board, withdb, ply=ply)
+            if not branches:
+                return self._score(variation, -INFINITY, withdb=withdb)
+            statics = [None] * len(branches)
+            if depth == 1 and self.evaluate_batch:
+                statics = self._statics(board, branches)
+            best = None
+            original = alpha
+            for i, branch in enumerate(branches):
+                self._step(branch, depth-1, -beta, -alpha, withdb, ply+1, statics[i])
+                if -branch.score > alpha:
+                    alpha = -branch.score
+                    best = branch.move
+                if alpha >= beta:
+                    self._cutoff(board, branch.move, depth, ply, not i)
+                    break
+            self._score(variation, alpha, depth, withdb, best, self._bound(alpha, original, beta))
+
+    def _qstep(self, board, alpha, beta, qdepth=0, stand=None):
+        self._stats.qnodes += 1
+        if stand is None:
+            stand = self.evaluate(board)
+        if stand >= beta:
+            return stand
+        alpha = max(alpha, stand)
+        if self._qdepth is not None and qdepth >= self._qdepth:
+            return alpha
+        for move in self._order(board, board.legal_moves(captures=True), None):
+            board.push(move)
+            score = -self._qstep(board, -beta, -alpha, qdepth+1)
+            board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
 
     def evaluate(self, board):
+        if self.evaluate_batch:
+            return self.evaluate_batch(features.planes([features.bitboards(board)]), board.turn)[0]
         raise Exception("evaluate is unimplemented in the base AI class, and must be overridden by a function that returns a number.")
\ No newline at end of file
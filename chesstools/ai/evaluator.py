@@ -0,0 +1,146 @@
+from .brain import AI
+
+# centipawns, (middlegame, endgame)
+MATERIAL = {
+    'Pawn': (82, 94),
+    'Knight': (337, 281),
+    'Bishop': (365, 297),
+    'Rook': (477, 512),
+    'Queen': (1025, 936),
+    'King': (0, 0)
+}
+PHASES = {'Pawn': 0, 'Knight': 1, 'Bishop': 1, 'Rook': 2, 'Queen': 4, 'King': 0}
+OPENING = sum([PHASES[name] * count for name, count in [('Knight', 4), ('Bishop', 4), ('Rook', 4), ('Queen', 2)]])
+
+# piece-square bonuses for white, laid out as seen from white's side (a8 first)
+PAWN = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0]
+PAWN_ENDGAME = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     20,  20,  20,  20,  20,  20,  20,  20,
+     10,  10,  10,  10,  10,  10,  10,  10,
+     10,  10,  10,  10,  10,  10,  10,  10,
+      0,   0,   0,   0,   0,   0,   0,   0]
+KNIGHT = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0]
+QUEEN = [
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20]
+KING = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20]
+KING_ENDGAME = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+TABLES = {
+    'Pawn': (PAWN, PAWN_ENDGAME),
+    'Knight': (KNIGHT, KNIGHT),
+    'Bishop': (BISHOP, BISHOP),
+    'Rook': (ROOK, ROOK),
+    'Queen': (QUEEN, QUEEN),
+    'King': (KING, KING_ENDGAME)
+}
+
+def _scores():
+    # (middlegame, endgame) per color, piece and square (a1 = 0), signed for white
+    scores = {'white': {}, 'black': {}}
+    for name, (mg, eg) in TABLES.items():
+        mgv, egv = MATERIAL[name]
+        scores['white'][name] = [(mgv + mg[sq ^ 56], egv + eg[sq ^ 56]) for sq in range(64)]
+        scores['black'][name] = [(-mgv - mg[sq], -egv - eg[sq]) for sq in range(64)]
+    return scores
+
+SCORES = _scores()
+
+class Tally(object):
+    __slots__ = ('middlegame', 'endgame', 'phase')
+
+    def __init__(self, board=None):
+        self.middlegame = self.endgame = self.phase = 0
+        if board:
+            for piece in board.pieces():
+                self.add(piece.color, piece.name, piece.pos[0] * 8 + piece.pos[1])
+
+    def copy(self):
+        tally = Tally()
+        tally.middlegame, tally.endgame, tally.phase = self.middlegame, self.endgame, self.phase
+        return tally
+
+    def add(self, color, name, sq):
+        mg, eg = SCORES[color][name][sq]
+        self.middlegame += mg
+        self.endgame += eg
+        self.phase += PHASES[name]
+
+    def remove(self, color, name, sq):
+        mg, eg = SCORES[color][name][sq]
+        self.middlegame -= mg
+        self.endgame -= eg
+        self.phase -= PHASES[name]
+
+    def score(self, color):
+        phase = min(self.phase, OPENING)
+        score = (self.middlegame * phase + self.endgame * (OPENING - phase)) / (OPENING * 100.0)
+        return color == 'white' and score or -score
+
+class Evaluator(AI):
+    def tally(self, board):
+        if not board.tally:
+            board.tally = Tally(board)
+        return board.tally
+
+    def evaluate(self, board):
+        return self.tally(board).score(board.turn)
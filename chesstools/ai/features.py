@@ -0,0 +1,18 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# plane order: white pawn, knight, bishop, rook, queen, king, then black's
+PIECES = ['Pawn', 'Knight', 'Bishop', 'Rook', 'Queen', 'King']
+COLORS = ['white', 'black']
+
+def bitboards(board):
+    return [board.bb[color][name] for color in COLORS for name in PIECES]
+
+def planes(rows):
+    # (n, 12, 64) uint8 occupancy planes, square a1 = 0, for n rows of bitboards()
+    if numpy is None:
+        raise ImportError("batched evaluation needs numpy")
+    packed = numpy.array(rows, dtype=numpy.uint64).astype('<u8')
+    return numpy.unpackbits(packed.view(numpy.uint8), bitorder='little').reshape(len(rows), 12, 64)
@@ -0,0 +1,53 @@
+from time import time
+
+COUNTERS = ['nodes', 'qnodes', 'cutoffs', 'firsts', 'probes', 'hits', 'ttcutoffs', 'prep', 'flush']
+
+class SearchStats(object):
+    __slots__ = ['move', 'book', 'ponderhit', 'started', 'elapsed', 'depths'] + COUNTERS
+
+    def __init__(self, book=False):
+        self.move = None
+        self.book = book
+        self.ponderhit = False
+        self.started = time()
+        self.elapsed = 0
+        self.depths = [] # (depth, seconds, nodes) as each iteration completes
+        for name in COUNTERS:
+            setattr(self, name, 0)
+
+    def merge(self, other):
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def collect(self, table):
+        for name, value in table.counters().items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def deepened(self, depth):
+        self.depths.append((depth, time() - self.started, self.nodes + self.qnodes))
+
+    def finish(self, move=None):
+        self.move = move
+        self.elapsed = time() - self.started
+        return self
+
+    def nps(self):
+        return self.elapsed and int((self.nodes + self.qnodes) / self.elapsed) or 0
+
+    def branching(self):
+        # nodes spent on the last full iteration over nodes spent on the one before it
+        counts = [0] + [nodes for depth, secs, nodes in self.depths]
+        if len(counts) < 3 or counts[-2] == counts[-3]:
+            return None
+        return round((counts[-1] - counts[-2]) / float(counts[-2] - counts[-3]), 3)
+
+    def data(self):
+        data = dict([(name, getattr(self, name)) for name in COUNTERS])
+        data.update(move=self.move, book=self.book, ponderhit=self.ponderhit, elapsed=self.elapsed,
+            nps=self.nps(), branching=self.branching(), depths=list(self.depths))
+        return data
+
+    def __repr__(self):
+        return "<SearchStats move: %s nodes: %s qnodes: %s nps: %s tt: %s/%s/%s ebf: %s depths: %s>"%(self.move,
+            self.nodes, self.qnodes, self.nps(), self.probes, self.hits, self.ttcutoffs, self.branching(),
+            " ".join(["%s:%s"%(d, round(s, 3)) for d, s, n in self.depths]))
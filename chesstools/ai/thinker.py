@@ -1,10 +1,17 @@
+from time import time
+from threading import Event, Lock
+from concurrent.futures import wait, FIRST_COMPLETED
 from fyg.util import Loggy
+from .stats import SearchStats
 
 INFINITY = float('inf')
-PROFILER = None # cProfile or pyinstrument
+PROFILER = None # default for Thinker(profiler=): cProfile or pyinstrument
+
+class SearchTimeout(Exception):
+	pass
 
 class Thinker(Loggy):
-	def __init__(self, table, timer, depth, stepper, mover, brancher, reporter, rofflim=3, dbuntil=20, rushbelow=240):
+	def __init__(self, table, timer, depth, stepper, mover, brancher, reporter, rofflim=3, dbuntil=20, rushbelow=240, movestogo=30, remote=None, workers=0, narrow=False, profiler=None):
 		self.table = table
 		self.timer = timer
 		self.depth = depth
@@ -15,9 +22,27 @@ class Thinker(Loggy):
 		self.brancher = brancher
 		self.reporter = reporter
 		self.rushbelow = rushbelow
+		self.movestogo = movestogo
+		self.remote = remote
+		self.workers = workers
+		self.narrow = narrow
+		self.profiler = profiler or PROFILER
+		self.deadline = None
+		self.stopped = False
+		self.halt = None # shared with pool workers, see AI._remote()
+		self.pondering = False
+		self.resolved = Event()
+		self.lock = Lock()
 
-	def setBoard(self, board, color):
+	def setBoard(self, board, color, stats=None, ponder=False, deadline=None):
 		self.board = board
+		self.color = color
+		self.stats = stats or SearchStats()
+		self.stopped = False
+		self.pondering = ponder
+		self.resolved.clear()
+		self.table.next_search()
+		self.table.counters()
 		movenum = board.fullmove
 		timeleft = self.timer.get_player(color)
 
@@ -27,19 +52,90 @@ class Thinker(Loggy):
 				self.withdb = False
 #		self.withdb = timeleft > self.rushbelow and movenum <= self.dbuntil
 
-		self.log("setBoard color", color, "move", movenum,
-			"time", round(timeleft), "withdb", self.withdb)
-		self.branches = self.brancher(board, self.withdb, True)
+		self.budget = ponder and INFINITY or self.allot(deadline)
+		self.log("setBoard color", color, "move", movenum, "time", round(timeleft),
+			"budget", round(self.budget, 2), "withdb", self.withdb, "ponder", ponder)
+		self.branches = self.brancher(board, self.withdb and not ponder, True)
+
+	def allot(self, deadline=None):
+		timeleft = self.timer.get_player(self.color)
+		budget = min(timeleft / 2, timeleft / self.movestogo + self.timer.increment)
+		if deadline:
+			budget = min(budget, deadline - time())
+		return budget
+
+	def ponderhit(self, deadline=None):
+		with self.lock:
+			self.budget = self.allot(deadline)
+			self.started = time()
+			if self.deadline:
+				self.deadline = self.started + self.budget
+			self.pondering = False
+		self.log("ponderhit budget", round(self.budget, 2))
+		self.stats.ponderhit = True
+		self.resolved.set()
+
+	def stop(self):
+		self.stopped = True
+		self.resolved.set()
+
+	def expired(self):
+		return self.stopped or self.halt is not None and self.halt.value or self.deadline and time() > self.deadline
 
 	def runoff(self):
 		self.branches = self.branches[:self.rofflim]
 		self.log("runoff pre:", " vs ".join([b.sig() for b in self.branches]))
-		self.depth += 1
-		self.evaluate()
-		self.depth -= 1
+		self.evaluate(self.depth + 1)
 		self.log("runoff post:", " vs ".join([b.sig() for b in self.branches]))
 
-	def evaluate(self):
+	def distribute(self, depth):
+		i = 0
+		hits = 0
+		bound = INFINITY
+		blen = len(self.branches)
+		queue = list(self.branches)
+		pending = {}
+		self.reporter('scoring %s moves on %s workers'%(blen, self.workers), True)
+		self.table.start()
+		self.halt.value = 0
+		try:
+			while queue or pending:
+				while queue and len(pending) < self.workers:
+					branch = queue.pop(0)
+					dtup = self.table.get(branch, depth, self.withdb, -INFINITY, bound)
+					if dtup:
+						branch.score = dtup[1]
+						hits += 1
+						i += 1
+						self.reporter('%s:%s (%s/%s) hit'%(branch.move, branch.score, i, blen), True)
+					else:
+						pending[self.remote(branch, depth, -INFINITY, bound, self.deadline, self.withdb)] = branch
+				if pending:
+					if self.stopped or self.deadline and time() > self.deadline:
+						raise SearchTimeout()
+					for future in wait(list(pending.keys()), 0.01, FIRST_COMPLETED)[0]:
+						branch = pending.pop(future)
+						branch.score, entries, rows, stats = future.result()
+						self.table.merge(entries)
+						self.table.extend(rows)
+						self.stats.merge(stats)
+						if self.narrow:
+							bound = min(bound, branch.score)
+						i += 1
+						self.reporter('%s:%s (%s/%s)'%(branch.move, branch.score, i, blen), True)
+		finally:
+			if pending: # stop the running tasks too, so they don't hold up the next search
+				self.halt.value = 1
+				for future in pending:
+					future.cancel()
+				wait(list(pending.keys()))
+		self.table.flush()
+		self.branches.sort()
+		return hits == blen
+
+	def evaluate(self, depth):
+		if self.workers > 1:
+			return self.distribute(depth)
 		i = 0
 		allhits = True
 		blen = len(self.branches)
@@ -47,26 +143,56 @@ class Thinker(Loggy):
 		for branch in self.branches:
 			i += 1
 			self.table.start()
-			allhits = self.stepper(branch, self.depth, -INFINITY, INFINITY, self.withdb)
+			allhits = self.stepper(branch, depth, -INFINITY, INFINITY, self.withdb)
 			self.reporter('%s:%s (%s/%s)'%(branch.move, branch.score, i, blen), True)
 			self.table.flush()
 		self.branches.sort()
 		return allhits
 
+	def deepen(self):
+		self.started = time()
+		self.deadline = None
+		for depth in range(1, self.depth + 1):
+			try:
+				allhits = self.evaluate(depth)
+			except SearchTimeout:
+				self.log("out of time at depth", depth)
+				return
+			self.moves = [branch.move_info() for branch in self.branches]
+			self.stats.deepened(depth)
+			with self.lock:
+				elapsed = time() - self.started
+				self.deadline = self.started + self.budget
+			self.log("depth", depth, "done in", round(elapsed, 3))
+			if depth < self.depth and elapsed * 2 > self.budget:
+				self.log("no time for depth", depth + 1)
+				return
+		if allhits and len(self.branches) > 1:
+			self.log("all hits! calling runoff()")
+			try:
+				self.runoff()
+			except SearchTimeout:
+				return self.log("out of time in runoff")
+			self.moves = [branch.move_info() for branch in self.branches]
+
 	def think(self):
 		if not self.branches:
 			return self.reporter('i lose!', True)
-		if self.evaluate() and len(self.branches) > 1:
-			self.log("all hits! calling runoff()")
-			self.runoff()
-		self.mover([branch.move_info() for branch in self.branches])
+		self.deepen()
+		if self.pondering:
+			self.resolved.wait()
+		self.deadline = None
+		if self.stopped:
+			return self.log("search stopped")
+		self.stats.collect(self.table)
+		self.mover(self.moves, self.stats)
 
 	def __call__(self):
-		if PROFILER == "cProfile":
+		if self.profiler == "cProfile":
 			import cProfile
 			cProfile.runctx("self.think()", None,
 				locals(), "pro/move%s.pro"%(self.board.fullmove,))
-		elif PROFILER == "pyinstrument":
+		elif self.profiler == "pyinstrument":
 			from pyinstrument import Profiler
 			with Profiler(interval=0.1) as profiler:
 				self.think()
@@ -1,41 +1,126 @@
+import atexit
+from array import array
+from argparse import ArgumentParser
+from queue import Queue, Empty
 from datetime import datetime
+from threading import Thread
 from fyg import config as confyg
 from fyg.util import Loggy
 from databae.poly import ModelBase
+from databae.model import FlatBase
 import databae as db
+from chesstools.bitboard import NAMES
+from chesstools.board import from_signature
+
+INFINITY = float('inf')
 
 confyg.log.allow.append("db")
 db.config.update("prags", "fast")
 db.config.update("optimize", True)
 db.config.pool.update("null", False)
 
-# TODO : ModelBase->FlatBase ; fixed-length sig
+EXACT, LOWER, UPPER = 0, 1, 2
+SLOT = 21 # bytes per slot: key 8, score 8, move 2, depth, bound, age
+MAXDEPTH = 127
+PROMOTIONS = [None, 'q', 'r', 'b', 'n']
+
+def pack(move):
+    if not move:
+        return 0
+    return (move.source[0] * 8 + move.source[1]
+        | (move.destination[0] * 8 + move.destination[1]) << 6
+        | PROMOTIONS.index(move.promotion and move.promotion.lower()) << 12)
+
+def signed(key): # sqlite integers are signed 64-bit
+    return key >= 2 ** 63 and key - 2 ** 64 or key
 
 class Transposition(ModelBase):
     sig = db.String(indexed=True)
     score = db.Integer()
     depth = db.Integer()
 
+class HashedTransposition(FlatBase):
+    sig = db.Integer(big=True, indexed=True)
+    score = db.Integer()
+    depth = db.Integer()
+
 class Table(Loggy):
-    def __init__(self, preppy=True):
+    def __init__(self, preppy=True, size=64, backlog=8, batch=5000, hashed=True, offline=False):
         self._all = {}
+        self.hashed = hashed
+        self.offline = offline # pool workers collect rows for the parent instead of reading the db
+        self.model = hashed and HashedTransposition or Transposition
+        self._queue = Queue(backlog)
+        self._writer = False
+        self.batch = batch
+        self.written = 0
+        self.latency = 0
         self.timers = {}
-        self._deepest = {}
         self.preppy = preppy
         self.prepped = 0
         self.skips = 0
         self.hits = 0
+        self.age = 0
+        self.filled = 0
+        self.probes = self.found = self.usable = 0
+        self.preptime = self.flushtime = 0
+        buckets = 1
+        while buckets * 4 * SLOT <= size * 2 ** 20:
+            buckets *= 2
+        self._mask = buckets - 1
+        slots = buckets * 2 # depth-preferred, always-replace
+        self._keys = array('Q', bytes(8 * slots))
+        self._scores = array('d', bytes(8 * slots))
+        self._moves = array('H', bytes(2 * slots))
+        self._depths = array('b', bytes(slots))
+        self._bounds = array('b', bytes(slots))
+        self._ages = array('B', bytes(slots))
+
+    def _find(self, key):
+        i = (key & self._mask) << 1
+        if self._keys[i] == key:
+            return i
+        if self._keys[i+1] == key:
+            return i + 1
 
-    def add(self, sig, dstup, withdb=False):
-        if sig not in self._deepest or self._deepest[sig][0] < dstup[0]:
-            self._deepest[sig] = dstup
-        if withdb:
+    def store(self, key, depth, score, bound=EXACT, move=0):
+        depth = min(depth, MAXDEPTH)
+        i = (key & self._mask) << 1
+        keys = self._keys
+        if keys[i] == key:
+            if depth < self._depths[i] and self._ages[i] == self.age:
+                return
+        elif self._ages[i] == self.age and depth < self._depths[i]:
+            i += 1
+        if not keys[i]:
+            self.filled += 1
+        if keys[i] != key:
+            self._moves[i] = 0
+        keys[i] = key
+        self._depths[i] = depth
+        self._scores[i] = score
+        self._bounds[i] = bound
+        self._ages[i] = self.age
+        if move:
+            self._moves[i] = move
+
+    def add(self, key, dstup, sig=None, bound=EXACT, move=None):
+        self.store(key, dstup[0], dstup[1], bound, pack(move))
+        if sig:
             if sig not in self._all:
                 self._all[sig] = []
             self._all[sig].append(dstup)
 
+    def next_search(self):
+        self.age = (self.age + 1) & 255
+
+    def signature(self, variation):
+        if self.hashed:
+            return signed(variation.key())
+        return variation.signature()
+
     def query(self, filt, order=None, single=False, timed=True):
-        q = Transposition.query(cols=[
+        q = self.model.query(cols=[
             "sig", "depth", "score"
         ]).filter(filt)
         if order is not None:
@@ -45,44 +130,116 @@ class Table(Loggy):
             return self.timed("query", func)
         return func()
 
-    def prep(self, allsigs, timed=False):
+    def prep(self, variations, timed=False):
         if not self.preppy:
             return
-        sigs = list(filter(lambda s : s not in self._deepest, allsigs))
-        if timed:
-            start = datetime.now()
-        transes = self.query(Transposition.sig.in_(sigs), timed=not timed)
+        keys = dict([(self.signature(v), v.key()) for v in variations if self._find(v.key()) is None])
+        start = datetime.now()
+        transes = self.query(self.model.sig.in_(list(keys.keys())), timed=not timed)
+        dt = (datetime.now() - start).total_seconds()
+        self.preptime += dt
         if timed:
-            self.log("prep", len(allsigs), "in", (datetime.now() - start).total_seconds())
-        slen = len(sigs)
+            self.log("prep", len(variations), "in", dt)
+        slen = len(keys)
         self.prepped += slen
         self.hits += len(transes)
-        self.skips += len(allsigs) - slen
+        self.skips += len(variations) - slen
         for trans in transes:
-            self.add(trans[0], (trans[1], trans[2]))
-
-    def get(self, sig, depth, withdb=False):
-        if sig in self._deepest:
-            dstup = self._deepest[sig]
-            if dstup[0] >= depth:
-                return dstup
-        if withdb and not self.preppy:
-            trans = self.query(Transposition.sig == sig, -Transposition.depth, True)
+            self.add(keys[trans[0]], (trans[1], trans[2]))
+
+    def get(self, variation, depth, withdb=False, alpha=-INFINITY, beta=INFINITY):
+        self.probes += 1
+        i = self._find(variation.key())
+        if i is not None:
+            self.found += 1
+            if self._depths[i] >= depth:
+                score, bound = self._scores[i], self._bounds[i]
+                if bound == EXACT or bound == LOWER and score >= beta or bound == UPPER and score <= alpha:
+                    self.usable += 1
+                    return (self._depths[i], score)
+        if withdb and not self.preppy and not self.offline:
+            trans = self.query(self.model.sig == self.signature(variation), -self.model.depth, True)
             if trans and trans[1] >= depth:
                 return (trans[1], trans[2])
 
-    def score(self, variation, score, depth, withdb=False):
-        self.add(variation.signature(), (depth, score), withdb)
+    def unmigrated(self):
+        if self.hashed and Transposition.query(cols=["index"]).get():
+            self.log("found fen-keyed transpositions, which the hashed table ignores - run chesstranspositions to migrate them")
+            return True
+
+    def counters(self):
+        counts = {'probes': self.probes, 'hits': self.found, 'ttcutoffs': self.usable,
+            'prep': self.preptime, 'flush': self.flushtime}
+        self.probes = self.found = self.usable = 0
+        self.preptime = self.flushtime = 0
+        return counts
+
+    def entries(self, keys):
+        found = [(key, self._find(key)) for key in keys]
+        return [(key, self._depths[i], self._scores[i], self._bounds[i], self._moves[i])
+            for key, i in found if i is not None]
+
+    def rows(self):
+        deepest = dict([(sig, max(tups)) for sig, tups in self._all.items()])
+        self._all = {}
+        return deepest
+
+    def extend(self, rows):
+        for sig, tup in rows.items():
+            if sig not in self._all:
+                self._all[sig] = []
+            self._all[sig].append(tup)
+
+    def merge(self, entries):
+        for entry in entries:
+            self.store(*entry)
+
+    def move(self, key):
+        i = self._find(key)
+        if i is not None and self._moves[i]:
+            m = self._moves[i]
+            return NAMES[m & 63], NAMES[(m >> 6) & 63], PROMOTIONS[m >> 12]
+
+    def score(self, variation, score, depth, withdb=False, move=None, bound=EXACT):
+        self.store(variation.key(), depth, score, bound, pack(move))
+        if withdb and bound == EXACT:
+            sig = self.signature(variation)
+            if sig not in self._all:
+                self._all[sig] = []
+            self._all[sig].append((depth, score))
 
     def trans(self, sig, tup):
-        trans = Transposition()
+        trans = self.model()
         trans.depth = tup[0]
         trans.score = tup[1]
         trans.sig = sig
         return trans
 
-    def transets(self, sig):
-        return list(map(lambda tup : self.trans(sig, tup), self._all[sig]))
+    def _write(self):
+        while True:
+            deepest = self._queue.get()
+            done = 1
+            while len(deepest) < self.batch:
+                try:
+                    batch = self._queue.get_nowait()
+                except Empty:
+                    break
+                done += 1
+                for sig, tup in batch.items():
+                    if sig not in deepest or deepest[sig] < tup:
+                        deepest[sig] = tup
+            start = datetime.now()
+            try:
+                db.put_multi([self.trans(sig, tup) for sig, tup in deepest.items()])
+                self.written += len(deepest)
+            except Exception as e:
+                self.log("write failed:", e)
+            self.latency += (datetime.now() - start).total_seconds()
+            for i in range(done):
+                self._queue.task_done()
+
+    def drain(self):
+        self._queue.join()
 
     def timed(self, name, cb):
         start = datetime.now()
@@ -91,26 +248,74 @@ class Table(Loggy):
         return rval
 
     def start(self):
-        self.size = len(self._deepest.keys())
+        self.size = self.filled
         self.started = datetime.now()
-        self.timers["query"] = self.timers["write"] = 0
+        self.timers["query"] = self.timers["wait"] = 0
 
     def report(self, saved):
         dt = (datetime.now() - self.started).total_seconds()
         r = lambda v : round(v, 3)
         rr = lambda v : r(v / dt)
         t = self.timers
-        newsize = len(self._deepest.keys())
+        newsize = self.filled
         self.log("saved:", saved, "cache:", newsize, "srate:",
             rr(saved), "crate:", rr(newsize - self.size))
-        self.log("total:", r(dt), "query:", r(t["query"]), "write:", r(t["write"]))
+        self.log("total:", r(dt), "query:", r(t["query"]), "wait:", r(t["wait"]),
+            "written:", self.written, "write latency:", r(self.latency), "backlog:", self._queue.qsize())
+        self.written = self.latency = 0
         if self.preppy:
             self.log("prepped:", self.prepped, "skips:", self.skips, "hits:", self.hits)
             self.prepped = self.skips = self.hits = 0
 
     def flush(self):
-        transes = sum(list(map(self.transets, self._all.keys())), [])
-        tlen = len(transes)
-        tlen and self.timed("write", lambda : db.put_multi(transes))
-        self._all = {}
-        self.report(tlen)
\ No newline at end of file
+        start = datetime.now()
+        deepest = self.rows()
+        if deepest:
+            if not self._writer:
+                self._writer = Thread(target=self._write)
+                self._writer.daemon = True
+                self._writer.start()
+                atexit.register(self.drain) # write out queued batches before the interpreter exits
+            self.timed("wait", lambda : self._queue.put(deepest))
+        self.flushtime += (datetime.now() - start).total_seconds()
+        self.report(len(deepest))
+
+def rehash(sig):
+    return signed(from_signature(sig).hash())
+
+def migrate(chunk=5000, purge=False, output=print):
+    last = offset = moved = 0
+    while True:
+        rows = Transposition.query(Transposition.index > last,
+            cols=["index", "sig", "depth", "score"]).order(Transposition.index).fetch(chunk)
+        if not rows:
+            break
+        last = rows[-1][0]
+        deepest = {}
+        for index, sig, depth, score in rows:
+            try:
+                key = rehash(sig)
+            except Exception as e:
+                output("skipping %s: %s"%(sig, e))
+                continue
+            if key not in deepest or deepest[key] < (depth, score):
+                deepest[key] = (depth, score)
+        db.put_multi([HashedTransposition(sig=key, depth=tup[0], score=tup[1])
+            for key, tup in deepest.items()])
+        offset += len(rows)
+        moved += len(deepest)
+        output("migrated %s rows into %s hashed rows"%(offset, moved))
+    if purge:
+        rows = Transposition.query().fetch(chunk)
+        while rows:
+            db.delete_multi(rows)
+            rows = Transposition.query().fetch(chunk)
+        output("purged fen-keyed transpositions")
+    return moved
+
+def _migrate_command_line():
+    parser = ArgumentParser(description="rekey fen-signed transpositions by position hash")
+    parser.add_argument("-c", "--chunk", type=int, default=5000, help="rows per batch")
+    parser.add_argument("-p", "--purge", action="store_true", help="delete the fen-keyed rows afterwards")
+    args = parser.parse_args()
+    migrate(args.chunk, args.purge)
@@ -1,18 +1,30 @@
 INFINITY = float('inf')
 
 class Variation(object):
+    __slots__ = ('board', 'move', 'score', 'current', '_sig', '_key', '_pushed')
+
     def __init__(self, board, move, score=-INFINITY, current=False):
-        if current:
-            self.board = board
-        else:
-            self.board = board.copy()
-            self.board.move(move)
+        self.board = board
         self.move = move
         self.score = score
+        self.current = current
         self._sig = None
+        self._key = None
+        self._pushed = False
+
+    def __enter__(self):
+        if not self.current:
+            self.board.push(self.move)
+            self.current = self._pushed = True
+        return self.board
+
+    def __exit__(self, *exc):
+        if self._pushed:
+            self.board.pop()
+            self.current = self._pushed = False
 
     def __neg__(self):
-        return Variation(self.board, self.move, -self.score, True)
+        return Variation(self.board, self.move, -self.score, self.current)
 
     def __cmp__(self, other):
         return cmp(self.score, other.score)
@@ -29,9 +41,23 @@ class Variation(object):
     def sig(self):
         return "%s %s"%(self.move, self.score)
 
+    def _position(self, func):
+        if self.current:
+            return func()
+        with self:
+            return func()
+
+    def key(self):
+        if self._key is None:
+            self._key = self._position(self.board.hash)
+        return self._key
+
+    def snapshot(self):
+        return self._position(self.board.fen)
+
     def signature(self):
         if not self._sig:
-            self._sig = self.board.fen_signature()
+            self._sig = self._position(self.board.fen_signature)
         return self._sig
 
     def move_info(self):
@@ -0,0 +1,252 @@
+from chesstools import COLORS
+from chesstools.move import SharedMove, to_algebraic
+
+# squares are numbered row * 8 + column, so a1 is 0, h1 is 7 and h8 is 63.
+SQUARES = [1 << i for i in range(64)]
+COORDS = [(i >> 3, i & 7) for i in range(64)]
+NAMES = [to_algebraic(c) for c in COORDS]
+FULL = (1 << 64) - 1
+PROMOTIONS = ['q','r','b','n']
+FILES = [0x0101010101010101 << i for i in range(8)]
+RANKS = [0xff << (8 * i) for i in range(8)]
+
+def square(pos):
+    return pos[0] * 8 + pos[1]
+
+def bits(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+def _on_board(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+def _jumps(offsets):
+    table = []
+    for r, c in COORDS:
+        bb = 0
+        for x, y in offsets:
+            if _on_board(r+x, c+y):
+                bb |= SQUARES[(r+x)*8+c+y]
+        table.append(bb)
+    return table
+
+KNIGHT = _jumps([(-2,-1),(-1,-2),(2,-1),(1,-2),(-2,1),(-1,2),(2,1),(1,2)])
+KING = _jumps([(x,y) for x in range(-1,2) for y in range(-1,2) if x or y])
+PAWN_ATTACKS = {'white': _jumps([(1,-1),(1,1)]), 'black': _jumps([(-1,-1),(-1,1)])}
+
+def _walk(r, c, x, y, occ=0):
+    bb = 0
+    r, c = r+x, c+y
+    while _on_board(r, c):
+        bb |= SQUARES[r*8+c]
+        if occ & SQUARES[r*8+c]:
+            break
+        r, c = r+x, c+y
+    return bb
+
+def _line(sq, x, y):
+    # every occupancy of the inner squares of a line, mapped to the
+    # squares a slider on sq attacks along that line.
+    r, c = COORDS[sq]
+    mask = 0
+    for d in [(x, y), (-x, -y)]:
+        ray = _walk(r, c, *d)
+        if ray:
+            far = ray & -ray if d[0] * 8 + d[1] < 0 else SQUARES[ray.bit_length() - 1]
+            mask |= ray ^ far
+    table = {}
+    sub = 0
+    while True:
+        table[sub] = _walk(r, c, x, y, sub) | _walk(r, c, -x, -y, sub)
+        sub = (sub - mask) & mask
+        if not sub:
+            break
+    return mask, table
+
+def _between():
+    table = [[0] * 64 for i in range(64)]
+    for a, (r, c) in enumerate(COORDS):
+        for x, y in [(x, y) for x in range(-1,2) for y in range(-1,2) if x or y]:
+            bb = 0
+            i, j = r+x, c+y
+            while _on_board(i, j):
+                table[a][i*8+j] = bb
+                bb |= SQUARES[i*8+j]
+                i, j = i+x, j+y
+    return table
+
+# squares strictly between two squares sharing a line (0 otherwise)
+BETWEEN = _between()
+ROOK_LINES = [(_line(sq, 0, 1), _line(sq, 1, 0)) for sq in range(64)]
+BISHOP_LINES = [(_line(sq, 1, 1), _line(sq, 1, -1)) for sq in range(64)]
+
+def _moves():
+    # one immutable SharedMove for every from/to pair a piece could ever play,
+    # indexed by src | dst << 6 | promotion << 12 (promotion 1-4 as in PROMOTIONS)
+    table = [None] * (5 << 12)
+    for src in range(64):
+        for dst in bits(KNIGHT[src] | rook_attacks(src, 0) | bishop_attacks(src, 0)):
+            table[src | dst << 6] = SharedMove(NAMES[src], NAMES[dst])
+            if abs((src & 7) - (dst & 7)) < 2 and (src >> 3, dst >> 3) in [(6, 7), (1, 0)]:
+                for i, p in enumerate(PROMOTIONS, 1):
+                    table[src | dst << 6 | i << 12] = SharedMove(NAMES[src], NAMES[dst], p)
+    return table
+
+def shared(src, dst, promotion=None):
+    return MOVES[src | dst << 6 | (promotion and PROMOTIONS.index(promotion.lower()) + 1 or 0) << 12]
+
+def rook_attacks(sq, occ):
+    (m1, t1), (m2, t2) = ROOK_LINES[sq]
+    return t1[occ & m1] | t2[occ & m2]
+
+def bishop_attacks(sq, occ):
+    (m1, t1), (m2, t2) = BISHOP_LINES[sq]
+    return t1[occ & m1] | t2[occ & m2]
+
+MOVES = _moves()
+
+def attackers(board, sq, color, occ=None):
+    bb = board.bb[color]
+    if occ is None:
+        occ = board.occupied['white'] | board.occupied['black']
+    diag = bb['Bishop'] | bb['Queen']
+    straight = bb['Rook'] | bb['Queen']
+    return ((KNIGHT[sq] & bb['Knight']) | (KING[sq] & bb['King'])
+        | (PAWN_ATTACKS[COLORS[color]][sq] & bb['Pawn'])
+        | (diag and bishop_attacks(sq, occ) & diag)
+        | (straight and rook_attacks(sq, occ) & straight))
+
+def sources(board, color, name, dst, capture=False):
+    # squares holding a piece of this type and color that could move to dst
+    bb = board.bb[color][name]
+    occ = board.occupied['white'] | board.occupied['black']
+    if name == 'Pawn':
+        if capture:
+            return PAWN_ATTACKS[COLORS[color]][dst] & bb
+        step, home = color == 'white' and (8, 0xff00) or (-8, 0xff000000000000)
+        src = dst - step
+        if 0 <= src < 64 and not bb & SQUARES[src] and not occ & SQUARES[src]:
+            src -= step
+            if not 0 <= src < 64 or not home & SQUARES[src]:
+                return 0
+        return 0 <= src < 64 and bb & SQUARES[src]
+    if name == 'Knight':
+        return KNIGHT[dst] & bb
+    if name == 'King':
+        return KING[dst] & bb
+    reach = 0
+    if name != 'Rook':
+        reach |= bishop_attacks(dst, occ)
+    if name != 'Bishop':
+        reach |= rook_attacks(dst, occ)
+    return reach & bb
+
+def safe_move(board, color, src, dst):
+    ksq = square(board.kings[color].pos)
+    if ksq == src:
+        ksq = dst
+    removed = SQUARES[dst]
+    occ = board.occupied['white'] | board.occupied['black']
+    if board.bb[color]['Pawn'] & SQUARES[src] and (src - dst) & 7 and not occ & SQUARES[dst]:
+        removed |= SQUARES[(src & ~7) | (dst & 7)] # en passant
+    occ = (occ & ~SQUARES[src] & ~removed) | SQUARES[dst]
+    return not attackers(board, ksq, COLORS[color], occ) & ~removed
+
+def pins(board, color, ksq):
+    pinned = {}
+    bb = board.bb[COLORS[color]]
+    occ = board.occupied['white'] | board.occupied['black']
+    snipers = ((rook_attacks(ksq, 0) & (bb['Rook'] | bb['Queen']))
+        | (bishop_attacks(ksq, 0) & (bb['Bishop'] | bb['Queen'])))
+    for sq in bits(snipers):
+        blockers = BETWEEN[ksq][sq] & occ
+        if blockers and not blockers & (blockers - 1) and blockers & board.occupied[color]:
+            pinned[blockers.bit_length() - 1] = BETWEEN[ksq][sq] | SQUARES[sq]
+    return pinned
+
+def _castles(board, color, occ):
+    king = board.kings[color]
+    row, col = king.pos
+    enemy = COLORS[color]
+    for rook in king.castle.values():
+        if not rook or board.get_square(rook.pos) is not rook:
+            continue
+        target = row*8 + rook.castle_king_column
+        if occ & SQUARES[target]:
+            continue
+        low = min(col, rook.castle_king_column, rook.column()) + 1
+        high = max(col, rook.castle_king_column, rook.column())
+        if [i for i in range(low, high) if occ & SQUARES[row*8+i]]:
+            continue
+        low = min(col, rook.castle_king_column) + 1
+        high = max(col, rook.castle_king_column)
+        if [i for i in range(low, high) if attackers(board, row*8+i, enemy, occ)]:
+            continue
+        rook_target = row*8 + (rook.castle_king_column == 6 and 5 or 3)
+        after = (occ & ~SQUARES[row*8+col] & ~SQUARES[square(rook.pos)]) | SQUARES[target] | SQUARES[rook_target]
+        if attackers(board, target, enemy, after):
+            continue
+        yield row*8+col, target
+
+def _pawn_moves(src, dst, last):
+    if SQUARES[dst] & last:
+        for p in PROMOTIONS:
+            yield src, dst, p
+    else:
+        yield src, dst, None
+
+def legal_moves(board, color, captures=False):
+    bb = board.bb[color]
+    enemy = COLORS[color]
+    us = board.occupied[color]
+    them = board.occupied[enemy]
+    occ = us | them
+    allowed = captures and them or ~us & FULL
+    ksq = square(board.kings[color].pos)
+    checkers = attackers(board, ksq, enemy, occ)
+    for dst in bits(KING[ksq] & allowed):
+        if not attackers(board, dst, enemy, occ ^ SQUARES[ksq]):
+            yield ksq, dst, None
+    if checkers & (checkers - 1): # double check: only the king may move
+        return
+    if checkers:
+        evasion = checkers | BETWEEN[ksq][checkers.bit_length() - 1]
+    else:
+        evasion = FULL
+        for src, dst in not captures and _castles(board, color, occ) or []:
+            yield src, dst, None
+    target = allowed & evasion
+    pinned = pins(board, color, ksq)
+    if color == 'white':
+        step, home, last = 8, 0xff00, 0xff00000000000000
+    else:
+        step, home, last = -8, 0xff000000000000, 0xff
+    ep = None
+    if board.turn == color and board.en_passant:
+        ep = square(board.en_passant)
+    for src in bits(bb['Pawn']):
+        pin = pinned.get(src, FULL)
+        dst = src + step
+        if not occ & SQUARES[dst]:
+            if SQUARES[dst] & evasion & pin and (not captures or SQUARES[dst] & last):
+                for move in _pawn_moves(src, dst, last):
+                    yield move
+            if not captures and SQUARES[src] & home and not occ & SQUARES[dst+step] and SQUARES[dst+step] & evasion & pin:
+                yield src, dst+step, None
+        for dst in bits(PAWN_ATTACKS[color][src] & them & target & pin):
+            for move in _pawn_moves(src, dst, last):
+                yield move
+        if ep is not None and PAWN_ATTACKS[color][src] & SQUARES[ep] and safe_move(board, color, src, ep):
+            yield src, ep, None
+    for src in bits(bb['Knight']):
+        if src not in pinned:
+            for dst in bits(KNIGHT[src] & target):
+                yield src, dst, None
+    for src in bits(bb['Bishop'] | bb['Queen']):
+        for dst in bits(bishop_attacks(src, occ) & target & pinned.get(src, FULL)):
+            yield src, dst, None
+    for src in bits(bb['Rook'] | bb['Queen']):
+        for dst in bits(rook_attacks(src, occ) & target & pinned.get(src, FULL)):
+            yield src, dst, None
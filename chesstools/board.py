@@ -1,33 +1,57 @@
-import random
+import re, random
 from chesstools import COLORS
-from chesstools.piece import Pawn, Knight, Bishop, Rook, Queen, King
-from chesstools.move import to_algebraic
+from chesstools.piece import Pawn, Knight, Bishop, Rook, Queen, King, LETTER_TO_PIECE
+from chesstools.move import Move, to_algebraic, to_array, column_to_index
+from chesstools import bitboard, zobrist
+from chesstools.bitboard import SQUARES, NAMES, square
 from functools import reduce
 
 LINEUP = [Rook, Knight, Bishop, Queen, King, Bishop, Knight, Rook]
+PIECE_TYPES = [Pawn, Knight, Bishop, Rook, Queen, King]
+PIECE_NAMES = [p.__name__ for p in PIECE_TYPES]
 PROMOS = {'R':Rook,'N':Knight,'B':Bishop,'Q':Queen}
+SAN = re.compile(r'^(?:([O0]-[O0](?:-[O0])?)|([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?)[+#!?]*$')
+
+class InvalidMoveException(Exception):
+    pass
 
 class Board(object):
-    def __init__(self, old_board=None, variant="standard", lineup=None):
+    def __init__(self, old_board=None, variant="standard", lineup=None, bitboards=True, fen=None):
+        self.bitboards = bitboards
+        self._undo = []
+        self._journal = None
+        self._indexed = False
+        self.tally = None
         if old_board:
             for key, val in list(old_board.items()):
                 setattr(self, key, val)
+            self._indexed = 'bb' in old_board
             for piece in self.pieces():
                 piece.board = self
+        elif fen:
+            self.reset_fen(fen)
         elif variant == "960":
             self.reset_960(lineup)
         else:
             self.reset()
 
     def pawns(self, color=None, column=None, row=None):
-        pawns = [p for p in self.pieces(color) if isinstance(p, Pawn)]
-        if column is not None:
-            pawns = [p for p in pawns if p.column() == column]
-        if row is not None:
-            pawns = [p for p in pawns if p.row() == row]
-        return pawns
+        return self.pieces(color, column, row, 'Pawn')
 
     def pieces(self, color=None, column=None, row=None, type=None, pos=None):
+        if self._indexed and (pos is None or pos is self.position):
+            mask = bitboard.FULL
+            if column is not None:
+                mask &= bitboard.FILES[column]
+            if row is not None:
+                mask &= bitboard.RANKS[row]
+            pieces = []
+            for c in color and [color] or ['white', 'black']:
+                bb = self.bb[c]
+                for name in type and [type] or PIECE_NAMES:
+                    for sq in bitboard.bits(bb[name] & mask):
+                        pieces.append(self.position[sq >> 3][sq & 7])
+            return pieces
         pos = pos or self.position
         pieces = reduce(list.__add__, [[piece for piece in r if piece] for r in pos])
         if color:
@@ -43,16 +67,68 @@ class Board(object):
     def all_focused(self, dest, color=None):
         return [piece for piece in self.pieces(color) if piece.can_target(dest)]
 
+    def legal_moves(self, color=None, captures=False):
+        color = color or self.turn
+        if self.bitboards:
+            return [bitboard.shared(a, b, p) for a, b, p in bitboard.legal_moves(self, color, captures)]
+        moves = reduce(list.__add__, [piece.all_legal_moves() for piece in self.pieces(color)])
+        if captures:
+            moves = [m for m in moves if m.promotion or not self.is_empty(m.destination)
+                or m.destination == self.en_passant and self.get_square(m.source).name == 'Pawn']
+        return moves
+
+    def parse_san(self, text):
+        san = SAN.match(text.strip())
+        if not san:
+            raise InvalidMoveException('could not parse "%s"'%text)
+        castle, letter, column, row, dest, promotion = san.groups()
+        color = self.turn
+        occ = self.occupied['white'] | self.occupied['black']
+        if castle:
+            king = self.kings[color]
+            target = square((king.row(), len(castle) == 3 and 6 or 2))
+            if bitboard.attackers(self, square(king.pos), COLORS[color], occ):
+                raise InvalidMoveException('cannot castle out of check with "%s"'%text)
+            for src, dst in bitboard._castles(self, color, occ):
+                if dst == target:
+                    return bitboard.shared(src, dst).copy()
+            raise InvalidMoveException('cannot castle with "%s"'%text)
+        dst = square(to_array(dest))
+        if self.occupied[color] & SQUARES[dst]:
+            raise InvalidMoveException('"%s" lands on a %s piece'%(text, color))
+        name = LETTER_TO_PIECE[letter or 'P'].__name__
+        capture = name == 'Pawn' and column is not None and column != dest[0]
+        if capture and not self.occupied[COLORS[color]] & SQUARES[dst] and to_array(dest) != self.en_passant:
+            raise InvalidMoveException('"%s" captures nothing'%text)
+        if name == 'Pawn' and not capture and occ & SQUARES[dst]:
+            raise InvalidMoveException('"%s" is blocked'%text)
+        candidates = bitboard.sources(self, color, name, dst, capture)
+        if column is not None:
+            candidates &= bitboard.FILES[column_to_index(column)]
+        if row is not None:
+            candidates &= bitboard.RANKS[int(row) - 1]
+        legal = [src for src in bitboard.bits(candidates) if bitboard.safe_move(self, color, src, dst)]
+        if len(legal) != 1:
+            raise InvalidMoveException('%s possibilities for "%s"'%(len(legal), text))
+        if name == 'Pawn' and dst // 8 in (0, 7) and not promotion:
+            raise InvalidMoveException('"%s" does not promote'%text)
+        if promotion and (name != 'Pawn' or dst // 8 not in (0, 7)):
+            raise InvalidMoveException('"%s" cannot promote'%text)
+        return Move(NAMES[legal[0]], dest, promotion and promotion.upper())
+
     def all_legal_moves(self):
-        return reduce(list.__add__, [piece.all_legal_moves() for piece in self.pieces(self.turn)])
+        return self.legal_moves(self.turn)
 
     def all_opponent_moves(self):
-        return reduce(list.__add__, [piece.all_legal_moves() for piece in self.pieces(COLORS[self.turn])])
+        return self.legal_moves(COLORS[self.turn])
 
     def copy(self):
-        return Board(
+        board = Board(
             {   'turn':self.turn,
-                'kings':self.kings.copy(),
+                'bitboards':self.bitboards,
+                'bb':{'white':self.bb['white'].copy(), 'black':self.bb['black'].copy()},
+                'occupied':self.occupied.copy(),
+                '_hash':self._hash,
                 'kr':self.kr,
                 'qr':self.qr,
                 'en_passant':self.en_passant,
@@ -60,8 +136,16 @@ class Board(object):
                 'halfmove':self.halfmove,
                 'all_positions':self.all_positions.copy(),
                 'this_position':self.this_position,
+                'tally':self.tally and self.tally.copy(),
                 'position':[[p and p.copy() or None for p in row] for row in self.position]
             })
+        board.kings = {}
+        for color, king in list(self.kings.items()):
+            k = board.kings[color] = board.get_square(king.pos)
+            for side, rook in list(king.castle.items()):
+                if rook and self.get_square(rook.pos) is rook:
+                    k.castle[side] = board.get_square(rook.pos)
+        return board
 
     def remake_lineup(self):
         self.LINEUP = []
@@ -69,6 +153,7 @@ class Board(object):
             self.LINEUP.append(piece)
 
     def reset(self, hard=True):
+        self._indexed = False
         if hard:
             self.remake_lineup()
         self.turn = 'white'
@@ -93,7 +178,8 @@ class Board(object):
         self.en_passant = None
         self.fullmove = 1
         self.halfmove = 0
-        self.this_position = self.fen_signature()
+        self._index()
+        self.this_position = self._hash
         self.all_positions = {self.this_position:1}
         self.changes = []
         self.captured = None
@@ -120,6 +206,77 @@ class Board(object):
             self.LINEUP[r2] = King
         self.reset(hard=False)
 
+    def reset_fen(self, fen):
+        fields = fen.split()
+        self._indexed = False
+        self.position = [[None] * 8 for i in range(8)]
+        for r, row in enumerate(reversed(fields[0].split('/'))):
+            c = 0
+            for char in row:
+                if char.isdigit():
+                    c += int(char)
+                else:
+                    color = char.isupper() and 'white' or 'black'
+                    self.position[r][c] = LETTER_TO_PIECE[char.upper()](self, color, (r,c))
+                    c += 1
+        self.turn = fields[1] == 'b' and 'black' or 'white'
+        self.kings = dict([(k.color, k) for k in self.pieces(type='King')])
+        self.qr, self.kr = 0, 7
+        castles = len(fields) > 2 and fields[2] or '-'
+        for color, king in list(self.kings.items()):
+            king.castle = {'king': None, 'queen': None}
+            for char in castles:
+                if char == '-' or char.isupper() != (color == 'white'):
+                    continue
+                if char.upper() in 'KQ': # outermost rook on that side
+                    side = char.upper() == 'K' and 'king' or 'queen'
+                    cols = [p.column() for p in self.pieces(color, row=king.row(), type='Rook')
+                        if (p.column() > king.column()) == (side == 'king')]
+                    if not cols:
+                        continue
+                    col = side == 'king' and max(cols) or min(cols)
+                else: # X-FEN rook file
+                    col = column_to_index(char.lower())
+                    side = col > king.column() and 'king' or 'queen'
+                rook = self.get_square((king.row(), col))
+                rook.side = side
+                rook.castle_king_column = side == 'king' and 6 or 2
+                king.castle[side] = rook
+                if side == 'king':
+                    self.kr = col
+                else:
+                    self.qr = col
+        self.en_passant = len(fields) > 3 and fields[3] != '-' and to_array(fields[3]) or None
+        self.halfmove = len(fields) > 4 and int(fields[4]) or 0
+        self.fullmove = len(fields) > 5 and int(fields[5]) or 1
+        self.changes = []
+        self.captured = None
+        self._index()
+        self.this_position = self._hash
+        self.all_positions = {self.this_position:1}
+
+    def _index(self):
+        self._indexed = False
+        self.bb = {}
+        self.occupied = {}
+        for color in COLORS:
+            self.bb[color] = dict([(p.__name__, 0) for p in PIECE_TYPES])
+            self.occupied[color] = 0
+        self._hash = zobrist.castles(self.kings) ^ zobrist.en_passant(self.en_passant)
+        if self.turn == 'black':
+            self._hash ^= zobrist.TURN
+        for piece in self.pieces():
+            sq = square(piece.pos)
+            self.bb[piece.color][piece.name] |= SQUARES[sq]
+            self.occupied[piece.color] |= SQUARES[sq]
+            self._hash ^= zobrist.PIECES[piece.color][piece.name][sq]
+        self._indexed = True
+        if self.tally:
+            self.tally = self.tally.__class__(self)
+
+    def hash(self):
+        return self._hash
+
     def _fen_layout(self):
         pieces = []
         for row in self.position:
@@ -188,9 +345,25 @@ class Board(object):
     def set_square(self, coords, piece, position=None):
         (r,c) = coords
         position = position or self.position
-        position[r][c] = piece
-        if position == self.position:
+        if position is self.position:
+            bit = SQUARES[r*8+c]
+            old = position[r][c]
+            if old:
+                self.bb[old.color][old.name] ^= bit
+                self.occupied[old.color] ^= bit
+                self._hash ^= zobrist.PIECES[old.color][old.name][r*8+c]
+                if self.tally:
+                    self.tally.remove(old.color, old.name, r*8+c)
+            if piece:
+                self.bb[piece.color][piece.name] |= bit
+                self.occupied[piece.color] |= bit
+                self._hash ^= zobrist.PIECES[piece.color][piece.name][r*8+c]
+                if self.tally:
+                    self.tally.add(piece.color, piece.name, r*8+c)
+            if self._journal is not None:
+                self._journal.append(((r,c), old))
             self.changes.append(((r,c), piece))
+        position[r][c] = piece
 
     def get_square(self, coords, position=None):
         (r,c) = coords
@@ -205,6 +378,8 @@ class Board(object):
 
     def safe_king(self, source, dest):
         p = self.get_square(source)
+        if self.bitboards:
+            return bitboard.safe_move(self, p.color, square(source), square(dest))
         if isinstance(p, King):
             kspot = dest
         else:
@@ -213,6 +388,8 @@ class Board(object):
 
     def safe_square(self, dest, color=None, position=None):
         color = color or self.turn
+        if self.bitboards and (position is None or position is self.position):
+            return not bitboard.attackers(self, square(dest), COLORS[color])
         position = position or self.position
         for piece in self.pieces(COLORS[color], pos=position):
             if piece.can_target(dest, position):
@@ -231,7 +408,7 @@ class Board(object):
                 ep = (a[0]-1,a[1])
             elif a[0] + 2 == b[0]:
                 ep = (a[0]+1,a[1])
-            elif self.en_passant == b:
+            elif self.en_passant == tuple(b):
                 cap_pos = (a[0],b[1])
                 self.captured = self.get_square(cap_pos, pos)
                 self.set_square(cap_pos, None, pos)
@@ -257,35 +434,83 @@ class Board(object):
         if self.all_positions[self.this_position] == 3:
             return "repetition"
         k = self.kings[self.turn]
-        if k.can_move():
-            return None
-        for piece in self.pieces(self.turn):
-            if piece.can_move():
+        if self.bitboards:
+            for move in bitboard.legal_moves(self, self.turn):
+                return None
+        else:
+            if k.can_move():
                 return None
+            for piece in self.pieces(self.turn):
+                if piece.can_move():
+                    return None
         if self.safe_square(k.pos):
             return "stalemate"
         else:
             return "checkmate"
 
     def move(self, move):
+        if not isinstance(move, Move):
+            move = move.copy() # notation belongs to the game record, not the shared instance
         self.changes = []
         piece = self.get_square(move.source)
         self.captured = self.get_square(move.destination)
         detail = ''
         if piece.name not in ['King','Pawn']:
-            possibilities = [p for p in self.pieces(self.turn) if p is not piece and p.name == piece.name and p.legal_move(move.destination)]
+            possibilities = [p for p in self.pieces(self.turn, type=piece.name) if p is not piece and p.legal_move(move.destination)]
             if possibilities:
                 dc, dr = '', ''
                 for p in possibilities:
                     if p.row() == piece.row(): dc = move.start[0]
                     elif p.column() == piece.column(): dr = move.start[1]
                 detail = '%s%s'%(dc,dr) or move.start[0]
-        move.set_pgn(piece, self.captured, detail)
+        en_passant = piece.name == 'Pawn' and move.source[1] != move.destination[1]
+        move.set_pgn(piece, self.captured or en_passant, detail)
+        self.push(move)
+        return move
+
+    def push(self, move):
+        self.changes = []
+        self.captured = self.get_square(move.destination)
+        self._journal = []
+        keys = zobrist.castles(self.kings) ^ zobrist.en_passant(self.en_passant) ^ zobrist.TURN
+        undo = (self.kings['white'].castle.copy(), self.kings['black'].castle.copy(),
+            self.en_passant, self.halfmove, self.fullmove, self.this_position, self._journal)
         self.make_move(move.source, move.destination, promotion=move.promotion)
+        if self.captured and self.captured.name == 'Rook':
+            castle = self.kings[self.captured.color].castle
+            for side, rook in list(castle.items()):
+                if rook is self.captured:
+                    castle[side] = None
+        self._journal = None
+        self._undo.append((move, self.captured, undo))
+        self._hash ^= keys ^ zobrist.castles(self.kings) ^ zobrist.en_passant(self.en_passant)
         self.turn = COLORS[self.turn]
-        self.this_position = self.fen_signature()
+        self.this_position = self._hash
         if self.this_position not in self.all_positions:
             self.all_positions[self.this_position] = 0
         self.all_positions[self.this_position] += 1
         if self.turn == 'white':
             self.fullmove += 1
+
+    def pop(self):
+        move, self.captured, undo = self._undo.pop()
+        wcastle, bcastle, self.en_passant, self.halfmove, self.fullmove, position, journal = undo
+        self.all_positions[self.this_position] -= 1
+        if not self.all_positions[self.this_position]:
+            del self.all_positions[self.this_position]
+        self.this_position = position
+        self.changes = []
+        for coords, piece in reversed(journal):
+            self.set_square(coords, piece)
+            if piece:
+                piece.pos = coords
+        self.kings['white'].castle = wcastle
+        self.kings['black'].castle = bcastle
+        self._hash = position
+        self.turn = COLORS[self.turn]
+        return move
+
+def from_signature(sig):
+    layout, rest = sig.split(" ", 1)
+    layout = "/".join(reversed(layout.split("/"))) # fen_signature() lists rank 1 first
+    return Board(fen="%s %s"%(layout, rest))
@@ -1,16 +1,21 @@
-import os, re, time
+import os, time, mmap, struct
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sqlalchemy import __version__ as sa_version
-from sqlalchemy import Table, Column, Integer, String, MetaData, create_engine
+from sqlalchemy import Table, Column, Integer, String, MetaData, create_engine, text
 from sqlalchemy.orm import registry, sessionmaker
-from chesstools.board import Board
-from chesstools.move import Move, to_array, to_algebraic, column_to_index, row_to_index
+from chesstools.board import Board, InvalidMoveException, from_signature
+from chesstools.move import to_array
+from chesstools.bitboard import NAMES, PROMOTIONS, square
+from chesstools.pgn import games
 
-TYPES = {'P':'Pawn', 'N':'Knight', 'B':'Bishop', 'R':'Rook', 'Q':'Queen', 'K':'King'}
-CASTLES = { 'white': {'O-O':'g1','O-O-O':'c1'},
-            'black': {'O-O':'g8','O-O-O':'c8'} }
 starttime = None
 
-COMMENT = re.compile(r'\{.*\}')
+RECORD = struct.Struct('>QHI') # position hash, packed move, strength
+KEY = struct.Struct('>Q')
+SPILL = 1000000 # aggregated moves held in memory before staging them to disk
+MOVE = 'position, start, "end", promotion'
+SAME = 'b.position = m.position AND b.start = m.start AND b."end" = m."end" AND b.promotion IS m.promotion'
 metadata = MetaData()
 
 bookmoves_table = Table('bookmoves', metadata,
@@ -49,118 +54,193 @@ def get_session(db):
 class InvalidBookException(Exception):
     pass
 
+def pack(start, end, promotion=None):
+    return (square(to_array(start)) | square(to_array(end)) << 6
+        | (promotion and PROMOTIONS.index(promotion.lower()) + 1 or 0) << 12)
+
+def unpack(move):
+    promotion = move >> 12
+    return NAMES[move & 63], NAMES[(move >> 6) & 63], promotion and PROMOTIONS[promotion - 1].upper() or None
+
 class Book(object):
     def __init__(self, db):
+        self.session = self.table = None
+        if os.path.isfile(db + '.bin'):
+            f = open(db + '.bin', 'rb')
+            self.size = os.path.getsize(db + '.bin') // RECORD.size
+            self.table = self.size and mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) or b''
+            f.close()
+            return
         db += '.book'
         if not os.path.isfile(db): raise InvalidBookException('could not find opening book at %s'%db)
         self.session = get_session(db)
 
+    def probe(self, board):
+        if self.session:
+            return self.check(board.fen_signature())
+        return self.lookup(board.hash())
+
     def check(self, position):
+        if not self.session:
+            return self.lookup(from_signature(position).hash())
         moves = self.session.query(BookMove).filter_by(position=position).all()
         moves.sort()
         moves.reverse()
         return [(move.start, move.end, move.promotion) for move in moves]
 
-def process_game(game, session, color):
+    def lookup(self, key):
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(self.table, mid * RECORD.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        moves = []
+        while lo < self.size:
+            k, move, strength = RECORD.unpack_from(self.table, lo * RECORD.size)
+            if k != key:
+                break
+            moves.append(unpack(move))
+            lo += 1
+        return moves
+
+def export(db, dest=None):
+    session = get_session(db + '.book')
+    positions = {}
+    for position, start, end, promotion, strength in session.query(BookMove.position,
+        BookMove.start, BookMove.end, BookMove.promotion, BookMove.strength):
+        if position not in positions:
+            positions[position] = {}
+        move = pack(start, end, promotion)
+        positions[position][move] = positions[position].get(move, 0) + strength
+    records = {}
+    for position, moves in positions.items():
+        key = from_signature(position).hash()
+        for move, strength in moves.items():
+            records[(key, move)] = records.get((key, move), 0) + strength
+    records = sorted([(key, -strength, move) for (key, move), strength in records.items()])
+    f = open((dest or db) + '.bin', 'wb')
+    for key, strength, move in records:
+        f.write(RECORD.pack(key, move, min(-strength, 2 ** 32 - 1)))
+    f.close()
+    return len(records)
+
+class Aggregator(object):
+    def __init__(self, session=None, limit=SPILL):
+        self.session = session
+        self.limit = limit
+        self.counts = {}
+        self.staged = 0
+        if session:
+            self.sql('DROP TABLE IF EXISTS bookstage')
+            self.sql('CREATE TABLE bookstage (position VARCHAR(81), start VARCHAR(2), "end" VARCHAR(2), promotion VARCHAR(1), strength INTEGER)')
+
+    def sql(self, query, params=None):
+        return self.session.execute(text(query), params)
+
+    def add(self, position, start, end, promotion=None):
+        key = (position, start, end, promotion)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.session and len(self.counts) >= self.limit:
+            self.spill()
+
+    def merge(self, counts):
+        for key, strength in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + strength
+        if len(self.counts) >= self.limit:
+            self.spill()
+
+    def spill(self):
+        if self.counts:
+            self.sql('INSERT INTO bookstage VALUES (:position, :start, :end, :promotion, :strength)',
+                [{'position': p, 'start': s, 'end': e, 'promotion': pr, 'strength': n}
+                    for (p, s, e, pr), n in self.counts.items()])
+            self.session.commit()
+            self.staged += len(self.counts)
+            self.counts = {}
+
+    def finish(self):
+        self.spill()
+        fresh = not self.sql('SELECT 1 FROM bookmoves LIMIT 1').first()
+        self.sql('DROP TABLE IF EXISTS bookmerge')
+        self.sql('CREATE TABLE bookmerge AS SELECT %s, SUM(strength) AS strength FROM bookstage GROUP BY %s'%(MOVE, MOVE))
+        self.sql('DROP TABLE bookstage')
+        if fresh:
+            self.sql('INSERT INTO bookmoves (%s, strength) SELECT %s, strength FROM bookmerge'%(MOVE, MOVE))
+        else:
+            self.sql('CREATE INDEX IF NOT EXISTS bookmoves_position ON bookmoves (position)')
+            self.sql('CREATE INDEX bookmerge_position ON bookmerge (position)')
+            self.sql('UPDATE bookmoves AS b SET strength = strength + (SELECT m.strength FROM bookmerge AS m WHERE %s) WHERE EXISTS (SELECT 1 FROM bookmerge AS m WHERE %s)'%(SAME, SAME))
+            self.sql('INSERT INTO bookmoves (%s, strength) SELECT %s, strength FROM bookmerge AS m WHERE NOT EXISTS (SELECT 1 FROM bookmoves AS b WHERE %s)'%(MOVE, MOVE, SAME))
+        self.sql('DROP TABLE bookmerge')
+        self.sql('CREATE INDEX IF NOT EXISTS bookmoves_position ON bookmoves (position)')
+        self.session.commit()
+        output('wrote %s staged moves'%self.staged, 1)
+
+def process_game(moves, aggregator, color):
     board = Board()
-    moves = [m.strip() for m in game.split(' ') if m and '.' not in m]
     for m in moves:
         position = board.fen_signature()
-        if '=' in m:
-            promotion = m[-1]
-            m = m[:-2]
-        else:
-            promotion = None
-        end = m[-2:]
-        if m in ['O-O','O-O-O']:
-            pieces = [board.kings[board.turn]]
-            end = CASTLES[board.turn][m]
-        elif m[0].isupper():
-            col, row = None, None
-            if len(m) > 3:
-                if len(m) == 5: col, row = column_to_index(m[1]), row_to_index(m[2])
-                elif m[1].isalpha(): col = column_to_index(m[1])
-                else: row = row_to_index(m[1])
-            pieces = [p for p in board.pieces(board.turn, col, row, TYPES[m[0]]) if p.legal_move(to_array(end))]
-        else:
-            pieces = [p for p in board.pawns(board.turn, column_to_index(m[0])) if p.legal_move(to_array(end))]
-        if len(pieces) != 1:
+        try:
+            move = board.parse_san(m)
+        except InvalidMoveException:
             output('\n******\nerror parsing game\nmove: "%s"\nfen: "%s"\n******'%(m,board.fen()))
-            raise Exception("bad move - %s possibilities for %s"%(len(pieces), m))
-        start = to_algebraic(pieces[0].pos)
-        move = Move(start, end, promotion)
+            raise
         if color in ['both', board.turn]:
-            bookmove = session.query(BookMove).filter_by(position=position, start=move.start, end=move.end, promotion=move.promotion).first()
-            if bookmove:
-                bookmove.strength += 1
-            else:
-                session.add(BookMove(position, move.start, move.end, move.promotion))
-                session.commit()
-        board.move(move)
+            aggregator.add(position, move.start, move.end, move.promotion)
+        board.push(move)
 
-def process_file(fname, session, color, player):
+def process_file(fname, aggregator, color, player):
     output('file %s started'%fname, 1)
     gnum = 0
-    f = open(fname)
-    txt = f.read().replace('\r','').replace('\n',' ')
-    f.close()
-    while txt:
-        start = txt.find(' 1.')
-        if start == -1: break
-        headers, txt = txt[:start], txt[start:]
-        end = txt.find(' 1-0')
-        for ending in [' 0-1',' 1/2-1/2',' *']:
-            e = txt.find(ending)
-            if end == -1 or e != -1 and e < end:
-                end = e
-        if end == -1: break
-        gtxt, txt = txt[:end], txt[end:]
+    for headers, moves in games(fname):
         if player:
             color = None
-            playerheaders = [(h[:5], h[7:h.index('"', 7)]) for h in headers.lower().split('[') if h[:6] in ['white ','black ']]
-            for colortag, nametag in playerheaders:
+            names = dict([(c, headers.get(c.title(), '').lower()) for c in ['white', 'black']])
+            for colortag, nametag in names.items():
                 if player in nametag:
                     if color:
                         color = "both"
                     else:
                         color = colortag
             if not color:
-                output('skipping game between %s and %s'%(playerheaders[0][1],playerheaders[1][1]), 3)
+                output('skipping game between %s and %s'%(names['white'], names['black']), 3)
                 continue
-        comment = COMMENT.search(gtxt)
-        while comment:
-            gtxt = gtxt[:comment.start()]+gtxt[comment.end():]
-            comment = COMMENT.search(gtxt)
-        par_open = gtxt.find('(')
-        while par_open != -1:
-            par_lvl = 1
-            par_close = par_open + 1
-            while par_close < len(gtxt):
-                if gtxt[par_close] == '(':
-                    par_lvl += 1
-                elif gtxt[par_close] == ')':
-                    par_lvl -= 1
-                if not par_lvl:
-                    break
-                par_close += 1
-            gtxt = gtxt[:par_open]+gtxt[par_close+1:]
-            par_open = gtxt.find('(')
-        process_game(gtxt.replace('x','').replace('+','').replace('#','').replace('.','. '), session, color)
+        process_game(moves, aggregator, color)
         gnum += 1
-        if not gnum % 10:
-            commit(session, gnum)
-    if gnum % 10:
-        commit(session, gnum)
+        if not gnum % 100:
+            progress(gnum)
+    if gnum % 100:
+        progress(gnum)
     output('file %s completed'%fname, 1)
 
-def commit(session, gnum):
-    session.commit()
+def progress(gnum):
     output('processed %s games'%(gnum), 2)
 
 def output(data,depth=0):
     print('  '*depth,str(time.time()-starttime)[:6],':',data)
 
-def build(pgn, db, color=None, player=None):
+def _init_worker(start):
+    global starttime
+    starttime = start
+
+def tally_file(fname, color, player):
+    tally = Aggregator()
+    process_file(fname, tally, color, player)
+    return tally.counts
+
+def process_files(fnames, aggregator, color, player, workers=0):
+    if not workers:
+        for fname in fnames:
+            process_file(fname, aggregator, color, player)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(starttime or time.time(),)) as pool:
+        for done, future in enumerate(as_completed([pool.submit(tally_file, fname, color, player) for fname in fnames]), 1):
+            aggregator.merge(future.result())
+            output('merged %s of %s files'%(done, len(fnames)), 1)
+
+def build(pgn, db, color=None, player=None, workers=0):
     if float(sa_version[:3]) < 0.5 and input("The chesstools book builder runs EXTREMELY SLOW on SQLAlchemy < 0.5, and you should probably STOP RIGHT NOW and upgrade SQLAlchemy. Are you sure you want to continue?\n") != 'yes':
         return
     global starttime
@@ -172,20 +252,31 @@ def build(pgn, db, color=None, player=None):
         output('goodbye')
     else:
         output('building database...')
-        session = get_session(db)
+        aggregator = Aggregator(get_session(db))
         if os.path.isfile(pgn):
-            process_file(pgn, session, color, player)
+            process_files([pgn], aggregator, color, player)
         elif os.path.isdir(pgn):
-            for f in [x for x in os.walk(pgn).next()[2] if x.endswith('.pgn')]:
-                process_file(os.path.join(pgn, f), session, color, player)
+            process_files([os.path.join(pgn, f) for f in next(os.walk(pgn))[2] if f.endswith('.pgn')],
+                aggregator, color, player, workers)
         else:
             output('source file or directory does not exist!')
+        aggregator.finish()
 
 def _build_command_line():
+    parser = ArgumentParser(description="build an opening book database from pgn-formatted games")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="replay pgn files in this many processes")
+    args = parser.parse_args()
     pgn, db = input('where is the file or directory of pgn-formatted games?\n'), input('\nwhat will you call this opening book database?\n')
     color, player = None, None
     while color not in ['white','black','both','player']:
         color = input('\nwhich color should i use?\n  "white", "black", "both", or "player" (to select player by name)\n')
     if color == 'player':
         player = input('\nok, which player?\n')
-    build(pgn, db, color, player)
\ No newline at end of file
+    build(pgn, db, color, player, args.workers)
+
+def _export_command_line():
+    db = input('which opening book database should i export?\n')
+    if not os.path.isfile(db + '.book'):
+        print('could not find opening book at %s.book'%db)
+    else:
+        print('wrote %s moves to %s.bin'%(export(db), db))
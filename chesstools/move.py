@@ -22,16 +22,16 @@ def column_to_index(i):
 def row_to_index(i):
     return int(i) - 1
 
-class Move(object):
+class BaseMove(object):
+    __slots__ = ('promotion', 'start', 'end', 'algebraic', 'source', 'destination', 'array_pos')
+
     def __init__(self, start, end, promotion=None):
         self.promotion = promotion
         self.start, self.end = self.algebraic = start, end
         self.source, self.destination = self.array_pos = to_array(start), to_array(end)
-        self.pgn = None
-        self.comment = None
 
     def __eq__(self, m):
-        return isinstance(m, Move) and m.algebraic == self.algebraic
+        return isinstance(m, BaseMove) and m.algebraic == self.algebraic
 
     def __ne__(self, m):
         return not self.__eq__(m)
@@ -40,10 +40,10 @@ class Move(object):
         return "<Move %s-%s>"%self.algebraic
 
     def __str__(self):
-        s = self.short_algebraic() or self.long_algebraic()
-        if self.comment:
-            s += ' {%s}'%self.comment
-        return s
+        return self.short_algebraic() or self.long_algebraic()
+
+    def copy(self):
+        return Move(self.start, self.end, self.promotion)
 
     def from_to_promotion(self):
         return self.start, self.end, self.promotion
@@ -51,6 +51,35 @@ class Move(object):
     def long_algebraic(self):
         return '%s-%s%s'%(self.start, self.end, self.promotion and '=%s'%self.promotion or '')
 
+    def short_algebraic(self):
+        return None
+
+class SharedMove(BaseMove):
+    # interned by move generation and handed to every board, so it can't be annotated - copy() it first
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if hasattr(self, 'array_pos'):
+            raise AttributeError("shared moves are immutable - annotate a copy()")
+        BaseMove.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        return SharedMove, self.from_to_promotion()
+
+class Move(BaseMove):
+    __slots__ = ('pgn', 'comment')
+
+    def __init__(self, start, end, promotion=None):
+        BaseMove.__init__(self, start, end, promotion)
+        self.pgn = None
+        self.comment = None
+
+    def __str__(self):
+        s = BaseMove.__str__(self)
+        if self.comment:
+            s += ' {%s}'%self.comment
+        return s
+
     def short_algebraic(self):
         return self.pgn
 
@@ -0,0 +1,90 @@
+import time
+from argparse import ArgumentParser
+from chesstools.board import Board
+from chesstools.piece import LETTER_TO_PIECE
+
+# well-known positions and their node counts by depth
+POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603]),
+    ("endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333]),
+    ("talkchess", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487]),
+    ("edwards", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594])
+]
+
+def perft(board, depth):
+    if not depth:
+        return 1
+    moves = board.all_legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth-1)
+        board.pop()
+    return nodes
+
+def divide(board, depth):
+    counts = []
+    for move in board.all_legal_moves():
+        board.push(move)
+        counts.append((move, perft(board, depth-1)))
+        board.pop()
+    return counts
+
+def timed(board, depth, split=False):
+    start = time.time()
+    if split:
+        counts = divide(board, depth)
+        nodes = sum([c for m, c in counts])
+    else:
+        counts = None
+        nodes = perft(board, depth)
+    return nodes, time.time() - start, counts
+
+def check(maxnodes=100000, output=print, bitboards=True):
+    failures = 0
+    for name, fen, counts in POSITIONS:
+        for depth, expected in enumerate(counts, 1):
+            if expected > maxnodes:
+                break
+            nodes, secs, m = timed(Board(fen=fen, bitboards=bitboards), depth)
+            ok = nodes == expected
+            failures += not ok
+            output("%s %s depth %s: %s (expected %s) %s nps"%(ok and "ok" or "FAIL", name,
+                depth, nodes, expected, int(nodes / max(secs, 0.000001))))
+    return not failures
+
+def _perft_command_line():
+    parser = ArgumentParser(description="count leaf nodes of the legal move tree")
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("-f", "--fen", help="start from this FEN instead of the initial position")
+    parser.add_argument("-l", "--lineup", help="chess960 back rank, such as RNBQKBNR")
+    parser.add_argument("-d", "--divide", action="store_true", help="show node counts per root move")
+    parser.add_argument("-c", "--check", type=int, nargs="?", const=100000, metavar="MAXNODES",
+        help="verify the bundled reference positions (up to MAXNODES nodes each)")
+    parser.add_argument("--legacy", action="store_true", help="use the square-walking engine")
+    args = parser.parse_args()
+    bitboards = not args.legacy
+    if args.check:
+        if not check(args.check, bitboards=bitboards):
+            raise SystemExit(1)
+        return
+    if args.fen:
+        board = Board(fen=args.fen, bitboards=bitboards)
+    elif args.lineup:
+        board = Board(variant="960", lineup=[LETTER_TO_PIECE[c] for c in args.lineup.upper()], bitboards=bitboards)
+    else:
+        board = Board(bitboards=bitboards)
+    nodes, secs, counts = timed(board, args.depth, args.divide)
+    for move, count in counts or []:
+        print("%s: %s"%(move.long_algebraic(), count))
+    print("nodes: %s time: %s nps: %s"%(nodes, round(secs, 3), int(nodes / max(secs, 0.000001))))
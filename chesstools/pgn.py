@@ -0,0 +1,64 @@
+import re
+
+RESULTS = ['1-0', '0-1', '1/2-1/2', '*']
+HEADER = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+TOKEN = re.compile(r'[{}();]|[^\s{}();]+')
+NUMBER = re.compile(r'\d+\.+')
+
+class Reader(object):
+    def __init__(self):
+        self.headers = {}
+        self.moves = []
+        self.comment = False
+        self.depth = 0
+
+    def game(self):
+        game = self.headers, self.moves
+        self.headers = {}
+        self.moves = []
+        self.depth = 0
+        return game
+
+    def read(self, line):
+        if not self.comment and not self.depth:
+            if line.startswith('%'):
+                return
+            header = line.startswith('[') and HEADER.match(line)
+            if header:
+                if self.moves:
+                    yield self.game()
+                self.headers[header.group(1)] = header.group(2)
+                return
+        for token in TOKEN.findall(line):
+            if self.comment:
+                self.comment = token != '}'
+            elif token == '{':
+                self.comment = True
+            elif token == ';':
+                return
+            elif token == '(':
+                self.depth += 1
+            elif token == ')':
+                self.depth = max(self.depth - 1, 0)
+            elif self.depth or token[0] == '$':
+                continue
+            elif token in RESULTS:
+                self.headers.setdefault('Result', token)
+                yield self.game()
+            else:
+                token = NUMBER.sub('', token, 1).rstrip('!?')
+                if token:
+                    self.moves.append(token)
+
+def games(source):
+    if isinstance(source, str):
+        with open(source, errors='replace') as f:
+            for game in games(f):
+                yield game
+        return
+    reader = Reader()
+    for line in source:
+        for game in reader.read(line.strip()):
+            yield game
+    if reader.moves:
+        yield reader.game()
@@ -1,13 +1,11 @@
 from chesstools import COLORS
-from chesstools.move import Move, to_algebraic, move_from_array
+from chesstools.move import to_algebraic
+from chesstools.bitboard import SQUARES, COORDS, KNIGHT, KING, BETWEEN, square, bits, rook_attacks, bishop_attacks, shared
 from functools import reduce
 
-MOVES = { "Knight": [[-2,-1],[-1,-2],[2,-1],[1,-2],[-2,1],[-1,2],[2,1],[1,2]],
-          "Bishop": [[-1,-1],[-1,1],[1,-1],[1,1]],
-          "Rook":   [[0,-1],[0,1],[-1,0],[1,0]] }
-MOVES["Queen"] = MOVES["Bishop"] + MOVES["Rook"]
-
 class Piece(object):
+    __slots__ = ('board', 'color', 'pos', 'name')
+
     def __init__(self, board, color, pos):
         self.board = board
         self.color = color
@@ -34,27 +32,21 @@ class Piece(object):
         return self.pos[1]
 
     def _all_moves(self):
-        m = []
-        for x, y in MOVES[self.name]:
-            a, b = self.row(), self.column()
-            while True:
-                a += x
-                b += y
-                if a < 0 or b < 0 or a > 7 or b > 7:
-                    break
-                p = self.board.get_square([a,b])
-                if p:
-                    if p.color != self.color:
-                        m.append([a,b])
-                    break
-                m.append([a,b])
-        return m
+        sq = square(self.pos)
+        occ = self.board.occupied['white'] | self.board.occupied['black']
+        reach = 0
+        if self.name != 'Rook':
+            reach |= bishop_attacks(sq, occ)
+        if self.name != 'Bishop':
+            reach |= rook_attacks(sq, occ)
+        return [list(COORDS[dest]) for dest in bits(reach & ~self.board.occupied[self.color])]
 
     def all_legal_moves(self):
-        return [move_from_array(self.pos, move) for move in self._all_moves() if self.board.safe_king(self.pos, move)]
+        sq = square(self.pos)
+        return [shared(sq, square(move)) for move in self._all_moves() if self.board.safe_king(self.pos, move)]
 
     def legal_move(self, dest):
-        return self._good_target(dest) and self._can_move_to(dest) and self._clear_path(self._next_in_path(list(dest))) and self.board.safe_king(self.pos, dest)
+        return self._good_target(dest) and self._can_move_to(dest) and self._clear_path(dest) and self.board.safe_king(self.pos, dest)
 
     def can_move(self):
         for dest in self._all_moves():
@@ -69,7 +61,7 @@ class Piece(object):
         return self._enemy_target(dest, layout) and self.can_target(dest, layout)
 
     def can_target(self, dest, layout=None):
-        return self.can_capture(dest, layout) and self._clear_path(self._next_in_path(list(dest)), layout)
+        return self.can_capture(dest, layout) and self._clear_path(dest, layout)
 
     def _enemy_target(self, d, layout=None):
         dest = self.board.get_square(d, layout)
@@ -80,26 +72,23 @@ class Piece(object):
         return not dest or dest.color != self.color
 
     def _clear_path(self, dest, layout=None):
-        if tuple(dest) == self.pos:
+        between = BETWEEN[square(self.pos)][square(dest)]
+        if not between:
             return True
-        if not self._clear_condition(dest, layout):
-            return False
-        return self._clear_path(self._next_in_path(dest), layout)
-
-    def _clear_condition(self, dest, layout):
-        return self.board.is_empty(dest, layout)
-
-    def _next_in_path(self, dest):
-        if dest[0] > self.row(): dest[0] -= 1
-        elif dest[0] < self.row(): dest[0] += 1
-        if dest[1] > self.column(): dest[1] -= 1
-        elif dest[1] < self.column(): dest[1] += 1
-        return dest
+        if self.board._indexed and (layout is None or layout is self.board.position):
+            return not between & (self.board.occupied['white'] | self.board.occupied['black'])
+        layout = layout or self.board.position
+        for sq in bits(between):
+            if layout[sq >> 3][sq & 7]:
+                return False
+        return True
 
     def move(self, pos):
         self.pos = pos
 
 class Pawn(Piece):
+    __slots__ = ('direction', 'home_row', 'promotion_row')
+
     def init(self):
         self.direction = self.color == 'white' and 1 or -1
         self.home_row = self.color == 'white' and 1 or 6
@@ -130,9 +119,10 @@ class Pawn(Piece):
         return self._pawn_scan(COLORS[self.color], [-1,0,1])
 
     def all_legal_moves(self):
-        m = [move_from_array(self.pos, move) for move in self._all_moves() if self.legal_move(move)]
+        sq = square(self.pos)
+        m = [shared(sq, square(move)) for move in self._all_moves() if self.legal_move(move)]
         if m and self.row() + self.direction == self.promotion_row:
-            m = reduce(list.__add__, [[Move(move.start, move.end, letter) for letter in ['q','r','b','n']] for move in m])
+            m = reduce(list.__add__, [[shared(sq, square(move.destination), letter) for letter in ['q','r','b','n']] for move in m])
         return m
 
     def _all_moves(self):
@@ -152,10 +142,13 @@ class Pawn(Piece):
             target = self.board.get_square(dest, layout)
             if target and target.color != self.color: # normal capture
                 return True
-            if dest == self.board.en_passant: # en passant
+            if tuple(dest) == self.board.en_passant: # en passant
                 return True
         return False
 
+    def can_target(self, dest, layout=None): # pawns guard both forward diagonals, occupied or not
+        return dest[0] == self.row() + self.direction and abs(dest[1] - self.column()) == 1
+
     def _can_move_to(self, dest):
         if dest[1] == self.column() and self.board.is_empty(dest): # jump
             if dest[0] == self.row() + self.direction: # single
@@ -167,34 +160,36 @@ class Pawn(Piece):
         return False
 
 class Knight(Piece):
+    __slots__ = ()
+
     def _all_moves(self):
-        m = []
-        r, c = self.row(), self.column()
-        for x, y in MOVES["Knight"]:
-            a, b = r+x, c+y
-            if a < 0 or b < 0 or a > 7 or b > 7 or not self._good_target([a,b]):
-                continue
-            m.append([a,b])
-        return m
+        return [list(COORDS[dest]) for dest in bits(KNIGHT[square(self.pos)] & ~self.board.occupied[self.color])]
 
     def can_capture(self, dest, layout=None):
-        r = abs(self.row() - dest[0])
-        c = abs(self.column() - dest[1])
-        if r and c and r + c == 3:
-            return True
-        return False
+        return bool(KNIGHT[square(self.pos)] & SQUARES[square(dest)])
 
     def _clear_path(self, dest, layout=None):
         return True
 
 class Bishop(Piece):
+    __slots__ = ()
+
     def can_capture(self, dest, layout=None):
         return abs(self.row() - dest[0]) == abs(self.column() - dest[1])
 
 class Rook(Piece):
+    __slots__ = ('side', 'castle_king_column')
+
     def init(self):
         self.side = None
 
+    def copy(self):
+        rook = Rook(None, self.color, self.pos)
+        if self.side:
+            rook.side = self.side
+            rook.castle_king_column = self.castle_king_column
+        return rook
+
     def can_capture(self, dest, layout=None):
         return dest[0] == self.row() or dest[1] == self.column()
 
@@ -204,10 +199,14 @@ class Rook(Piece):
             self.board.kings[self.color].castle[self.side] = None
 
 class Queen(Piece):
+    __slots__ = ()
+
     def can_capture(self, dest, layout=None):
         return dest[0] == self.row() or dest[1] == self.column() or abs(self.row() - dest[0]) == abs(self.column() - dest[1])
 
 class King(Piece):
+    __slots__ = ('castle', 'home_row')
+
     def init(self):
         self.castle = {'king': None,'queen': None}
         self.home_row = self.color == 'black' and 7 or 0
@@ -225,44 +224,29 @@ class King(Piece):
         return k
 
     def _all_moves(self):
-        m = []
-        row, col = self.row(), self.column()
-        for x in range(-1,2):
-            for y in range(-1,2):
-                if x or y:
-                    a, b = row+x, col+y
-                    if a < 0 or b < 0 or a > 7 or b > 7:
-                        continue
-                    if self._good_target([a,b]):
-                        m.append([a,b])
+        sq = square(self.pos)
+        m = [list(COORDS[dest]) for dest in bits(KING[sq] & ~self.board.occupied[self.color])]
         if self.board.safe_square(self.pos):
+            occ = self.board.occupied['white'] | self.board.occupied['black']
+            row, col = self.row(), self.column()
             for rook in list(self.castle.values()):
                 if rook and rook == self.board.get_square(rook.pos):
-                    target_square = [row, rook.castle_king_column]
-                    # target is empty
-                    safemove = self.board.is_empty(target_square)
-                    # king and rook are unimpeded
-                    if safemove:
-                        low = min(col, rook.castle_king_column, rook.column()) + 1
-                        high = max(col, rook.castle_king_column, rook.column())
-                        for mid_square in [[row, i] for i in range(low, high)]:
-                            if not self.board.is_empty(mid_square):
-                                safemove = False
-                                break
+                    target = row*8 + rook.castle_king_column
+                    # target is empty, and king and rook are unimpeded
+                    low = min(col, rook.castle_king_column, rook.column())
+                    high = max(col, rook.castle_king_column, rook.column())
+                    if occ & (SQUARES[target] | BETWEEN[row*8+low][row*8+high]):
+                        continue
                     # king's path is safe
-                    if safemove:
-                        low = min(col, rook.castle_king_column) + 1
-                        high = max(col, rook.castle_king_column)
-                        for mid_square in [[row, i] for i in range(low, high)]:
-                            if not self.board.safe_square(mid_square):
-                                safemove = False
-                                break
-                    if safemove:
-                        m.append(target_square)
+                    low = min(col, rook.castle_king_column)
+                    high = max(col, rook.castle_king_column)
+                    if [mid for mid in bits(BETWEEN[row*8+low][row*8+high]) if not self.board.safe_square(COORDS[mid])]:
+                        continue
+                    m.append([row, rook.castle_king_column])
         return m
 
     def can_capture(self, dest, layout=None):
-        return abs(self.row() - dest[0]) < 2 and abs(self.column() - dest[1]) < 2
+        return bool(KING[square(self.pos)] & SQUARES[square(dest)])
 
     def _can_move_to(self, dest):
         if self.can_capture(dest): # normal move
@@ -273,8 +257,11 @@ class King(Piece):
                     return True
         return False
 
-    def _clear_condition(self, dest, layout):
-        return self.board.is_empty(dest) and self.board.safe_king(self.pos, dest)
+    def _clear_path(self, dest, layout=None):
+        for sq in bits(BETWEEN[square(self.pos)][square(dest)]):
+            if not self.board.is_empty(COORDS[sq]) or not self.board.safe_king(self.pos, COORDS[sq]):
+                return False
+        return True
 
     def move(self, pos):
         self.pos = pos
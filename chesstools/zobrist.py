@@ -0,0 +1,23 @@
+from random import Random
+
+# fixed seed: keys must match across processes and runs, since
+# they end up in transposition tables and opening books.
+_rand = Random(0x5eed)
+_key = lambda : _rand.getrandbits(64)
+
+PIECES = dict([(color, dict([(name, [_key() for i in range(64)])
+    for name in ['Pawn', 'Knight', 'Bishop', 'Rook', 'Queen', 'King']]))
+    for color in ['white', 'black']])
+TURN = _key()
+CASTLES = [_key() for i in range(4)]
+EN_PASSANT = [_key() for i in range(8)]
+
+def castles(kings):
+    h = 0
+    for i, (color, side) in enumerate([('white', 'king'), ('white', 'queen'), ('black', 'king'), ('black', 'queen')]):
+        if kings[color].castle[side]:
+            h ^= CASTLES[i]
+    return h
+
+def en_passant(pos):
+    return pos and EN_PASSANT[pos[1]] or 0
@@ -17,6 +17,9 @@ setup(
     entry_points = '''
         [console_scripts]
         buildchessbook = chesstools.book:_build_command_line
+        exportchessbook = chesstools.book:_export_command_line
+        chessperft = chesstools.perft:_perft_command_line
+        chesstranspositions = chesstools.ai.transposition:_migrate_command_line
     ''',
     install_requires = [
         'databae >= 0.1.4.18'
@@ -0,0 +1,32 @@
+import time
+import pytest
+from chesstools.board import Board
+from chesstools.ai import AI
+
+numpy = pytest.importorskip("numpy")
+
+class Clock(object):
+    increment = 0
+
+    def get_player(self, color):
+        return 600
+
+class Linear(AI):
+    WEIGHTS = numpy.array([1, 3, 3, 5, 9, 0] * 2) * numpy.repeat([1, -1], 6)
+
+    def evaluate_batch(self, planes, color):
+        scores = planes.sum(axis=2).dot(self.WEIGHTS)
+        if color == 'black':
+            scores = -scores
+        return scores
+
+def test_batch_only_ai_moves():
+    moves = []
+    ai = Linear(Clock(), lambda *m: moves.append(m), depth=2, preppy=False, hashdb=False)
+    ai(Board(fen="r1bqkbnr/pppp1ppp/2n5/4p3/3PP3/5N2/PPP2PPP/RNBQKB1R b KQkq - 0 3"), 'black')
+    for i in range(600):
+        if moves:
+            break
+        time.sleep(0.1)
+    assert len(moves) == 1
+    assert ai.stats.qnodes
@@ -0,0 +1,10 @@
+from chesstools import perft
+
+def _quiet(*args):
+    pass
+
+def test_bitboard_counts():
+    assert perft.check(maxnodes=10000, output=_quiet)
+
+def test_legacy_counts():
+    assert perft.check(maxnodes=3000, output=_quiet, bitboards=False)
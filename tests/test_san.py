@@ -0,0 +1,60 @@
+import pytest
+from chesstools.board import Board, InvalidMoveException
+
+def _parse(fen, san):
+    return Board(fen=fen).parse_san(san)
+
+def test_en_passant():
+    board = Board(fen='rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3')
+    move = board.parse_san('exf6')
+    assert str(move) == 'e5-f6'
+    board.move(move)
+    assert board.get_square((4, 5)) is None
+    with pytest.raises(InvalidMoveException):
+        Board(fen='rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3').parse_san('exd6')
+
+def test_capture_promotion():
+    move = _parse('2r1k3/1P6/8/8/8/8/8/4K3 w - - 0 1', 'bxc8=Q')
+    assert str(move) == 'b7-c8=Q' and move.promotion == 'Q'
+
+def test_promotion_without_equals():
+    move = _parse('4k3/2P5/8/8/8/8/8/4K3 w - - 0 1', 'c8Q')
+    assert str(move) == 'c7-c8=Q'
+    move = _parse('4k3/2P5/8/8/8/8/8/4K3 w - - 0 1', 'c8n')
+    assert move.promotion == 'N'
+    with pytest.raises(InvalidMoveException):
+        _parse('4k3/2P5/8/8/8/8/8/4K3 w - - 0 1', 'c8')
+
+def test_file_disambiguation():
+    fen = '4k3/8/8/8/8/5N2/8/1N2K3 w - - 0 1'
+    assert str(_parse(fen, 'Nbd2')) == 'b1-d2'
+    assert str(_parse(fen, 'Nfd2')) == 'f3-d2'
+    with pytest.raises(InvalidMoveException):
+        _parse(fen, 'Nd2')
+
+def test_rank_disambiguation():
+    fen = '4k3/R7/8/8/8/8/8/R3K3 w - - 0 1'
+    assert str(_parse(fen, 'R1a3')) == 'a1-a3'
+    assert str(_parse(fen, 'R7a3')) == 'a7-a3'
+    with pytest.raises(InvalidMoveException):
+        _parse(fen, 'Ra3')
+
+def test_castling():
+    fen = '4k3/8/8/8/8/8/8/R3K2R w KQ - 0 1'
+    assert str(_parse(fen, 'O-O')) == 'e1-g1'
+    assert str(_parse(fen, '0-0-0')) == 'e1-c1'
+
+def test_castling_in_check():
+    with pytest.raises(InvalidMoveException):
+        _parse('4k3/8/8/8/8/8/8/r3K2R w K - 0 1', 'O-O')
+    with pytest.raises(InvalidMoveException):
+        _parse('4k3/8/8/8/8/8/6p1/4K2R w K - 0 1', 'O-O')
+
+@pytest.mark.parametrize('san', ['zz', 'Qe2', 'Ne4', 'Ke3', 'e5', 'Rxe8', 'a8=Q'])
+def test_illegal(san):
+    with pytest.raises(InvalidMoveException):
+        _parse('r3k3/8/8/8/8/8/8/R3K3 w Q - 0 1', san)
+
+def test_pinned():
+    with pytest.raises(InvalidMoveException):
+        _parse('4k3/4r3/8/8/8/8/4N3/4K3 w - - 0 1', 'Nc3')
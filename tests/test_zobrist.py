@@ -0,0 +1,20 @@
+from chesstools.board import Board, from_signature
+
+def _play(board, sans):
+    for san in sans:
+        board.move(board.parse_san(san))
+
+def test_hash_after_rook_captured_at_home():
+    board = Board()
+    _play(board, ['b3', 'g5', 'Bb2', 'Nh6', 'Bxh8'])
+    assert board.kings['black'].castle['king'] is None
+    assert board.hash() == from_signature(board.fen_signature()).hash()
+    board.pop()
+    assert board.kings['black'].castle['king'] is not None
+    assert board.hash() == from_signature(board.fen_signature()).hash()
+
+def test_hash_matches_rebuild_along_a_game():
+    board = Board()
+    for san in ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6', 'Bxc6', 'dxc6', 'O-O', 'Bg4', 'h3', 'Bxf3', 'Qxf3']:
+        board.move(board.parse_san(san))
+        assert board.hash() == from_signature(board.fen_signature()).hash()